@@ -1,6 +1,8 @@
 # Main bot file to initialize and run the Discord bot
 import discord
 from discord.ext import commands
+import hashlib
+import json
 import logging
 import os
 from dotenv import load_dotenv
@@ -9,6 +11,9 @@ load_dotenv()
 
 TOKEN = os.getenv("DISCORD_TOKEN")  # Or set your token directly
 
+# Hash of the last synced command tree, used to skip redundant syncs
+COMMAND_HASH_FILE = "command_tree.hash"
+
 intents = discord.Intents.default()
 intents.message_content = True
 intents.guilds = True
@@ -31,21 +36,76 @@ async def setup_monitor_commands():
     await bot.add_cog(monitor_commands.MonitorCommands(bot, monitor_manager))
     logging.info("MonitorCommands cog loaded successfully.")
 
-# In your on_ready or startup logic, call:
-@bot.event
-async def on_ready():
-    logging.info(f"Logged in as {bot.user} (ID: {bot.user.id})")
-    await load_modules()
-    await setup_monitor_commands()
+async def sync_commands_if_changed():
+    """
+    Sync the command tree with Discord, but only when it differs from the last sync.
+    """
+    payload = json.dumps([command.to_dict() for command in bot.tree.get_commands()], sort_keys=True)
+    tree_hash = hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    previous_hash = None
+    if os.path.exists(COMMAND_HASH_FILE):
+        with open(COMMAND_HASH_FILE, "r") as f:
+            previous_hash = f.read().strip()
+
+    if tree_hash == previous_hash:
+        logging.info("Command tree unchanged, skipping sync.")
+        return
+
     try:
         synced = await bot.tree.sync()
         logging.info(f"Synced {len(synced)} commands.")
+        with open(COMMAND_HASH_FILE, "w") as f:
+            f.write(tree_hash)
     except Exception as e:
         logging.error(f"Failed to sync commands: {e}")
 
-    # Load and start monitors
-    await monitor_manager.load_monitors_from_db()
-    await monitor_manager.start_monitors()
+async def ensure_schemas():
+    """
+    Create the tables the commands read from, so they work before the sweep has ever run.
+    """
+    from tools.connector import db_connector
+    from tools.session_store import ensure_session_schema
+    from tools.player_stats import ensure_player_stats_schema
+    from tools.copresence import ensure_copresence_schema
+    from tools.alt_correlator import ensure_alt_schema
+    try:
+        conn = await db_connector()
+        try:
+            for ensure in (ensure_session_schema, ensure_player_stats_schema, ensure_copresence_schema, ensure_alt_schema):
+                await ensure(conn)
+        finally:
+            conn.close()
+    except Exception as e:
+        logging.error(f"Failed to create tables: {e}")
+
+async def load_server_registry():
+    """
+    Fill the server registry up front; the bot doesn't run the sweep that would otherwise load it.
+    """
+    from tools.server_registry import server_registry
+    try:
+        await server_registry.load()
+    except Exception as e:
+        logging.error(f"Failed to load the server registry: {e}")
+
+# One-time setup, runs before the first connect and never again on reconnect
+async def setup_hook():
+    await ensure_schemas()
+    await load_server_registry()
+    await load_modules()
+    await setup_monitor_commands()
+    await sync_commands_if_changed()
+
+bot.setup_hook = setup_hook
+
+# on_ready fires again after every gateway reconnect, so it must stay idempotent
+@bot.event
+async def on_ready():
+    logging.info(f"Logged in as {bot.user} (ID: {bot.user.id})")
+
+    # Start only the monitors that are not already running
+    await monitor_manager.reconcile_monitors()
     logging.info("All modules and monitors loaded.")
     
 
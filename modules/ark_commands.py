@@ -4,18 +4,25 @@ from discord import app_commands
 from discord.ext import commands
 import asyncio
 from tools.EOS import EOS
-import aiohttp
-import json
 import logging
 from discord.ui import View, Button
 import datetime
-from tools.database_tools import create_history_graph  # Import the function
+from tools.database_tools import create_history_graph, create_comparison_graph  # Import the function
+from tools.server_list_feed import server_list_feed
+from tools.server_list_view import server_table, MODES, SORT_KEYS
 import os
 
 class ServerListView(View):
-    def __init__(self, embeds):
+    '''
+    Pages through a result set, building each page's embed only when it is first shown.
+    build_page(index) returns the embed for a page.
+    '''
+
+    def __init__(self, page_count, build_page):
         super().__init__(timeout=120)
-        self.embeds = embeds
+        self.page_count = page_count
+        self.build_page = build_page
+        self.pages = {}  # page index -> embed, built on demand
         self.current = 0
 
         self.prev_button = Button(label="Previous", style=discord.ButtonStyle.secondary)
@@ -27,21 +34,26 @@ class ServerListView(View):
         self.add_item(self.next_button)
         self.update_buttons()
 
+    def page(self, index):
+        if index not in self.pages:
+            self.pages[index] = self.build_page(index)
+        return self.pages[index]
+
     async def prev_page(self, interaction: discord.Interaction):
         if self.current > 0:
             self.current -= 1
             self.update_buttons()
-            await interaction.response.edit_message(embed=self.embeds[self.current], view=self)
+            await interaction.response.edit_message(embed=self.page(self.current), view=self)
 
     async def next_page(self, interaction: discord.Interaction):
-        if self.current < len(self.embeds) - 1:
+        if self.current < self.page_count - 1:
             self.current += 1
             self.update_buttons()
-            await interaction.response.edit_message(embed=self.embeds[self.current], view=self)
+            await interaction.response.edit_message(embed=self.page(self.current), view=self)
 
     def update_buttons(self):
         self.prev_button.disabled = self.current == 0
-        self.next_button.disabled = self.current == len(self.embeds) - 1
+        self.next_button.disabled = self.current >= self.page_count - 1
 
 class ArkCommands(commands.Cog):
     def __init__(self, bot):
@@ -55,33 +67,38 @@ class ArkCommands(commands.Cog):
         max_retries = 3
 
         graph_path = None
-        try:
+
+        async def generate_graph():
             # Generate the graph with retries
             for attempt in range(max_retries):
                 try:
                     logging.info(f"Generating graph for server {server_number} (attempt {attempt + 1})...")
-                    graph_path = await asyncio.wait_for(create_history_graph(server_number, 2), timeout=10)
-                    break
+                    return await asyncio.wait_for(create_history_graph(server_number, 2), timeout=10)
                 except asyncio.TimeoutError:
                     logging.warning(f"Graph generation timed out for server {server_number} (attempt {attempt + 1}).")
                 except Exception as e:
                     logging.error(f"Error generating graph for server {server_number} (attempt {attempt + 1}): {e}")
-            else:
-                logging.error(f"Failed to generate graph for server {server_number} after {max_retries} attempts.")
+            logging.error(f"Failed to generate graph for server {server_number} after {max_retries} attempts.")
+            return None
 
+        async def fetch_server_info():
             # Fetch server info with retries
-            result = None
             for attempt in range(max_retries):
                 try:
                     logging.info(f"Fetching server info for {server_number} (attempt {attempt + 1})...")
                     result = await asyncio.wait_for(eos.matchmaking(server_number), timeout=10)
                     if result:
-                        break
+                        return result
                 except asyncio.TimeoutError:
                     logging.warning(f"Fetching server info timed out for {server_number} (attempt {attempt + 1}).")
                 except Exception as e:
                     logging.error(f"Error fetching server info for {server_number} (attempt {attempt + 1}): {e}")
-            else:
+            return None
+
+        try:
+            # The graph and the server info don't depend on each other, fetch them together
+            graph_path, result = await asyncio.gather(generate_graph(), fetch_server_info())
+            if not result:
                 await interaction.followup.send(f"Failed to fetch server info for `{server_number}` after {max_retries} attempts.", ephemeral=True)
                 return
 
@@ -124,94 +141,128 @@ class ArkCommands(commands.Cog):
             if graph_path:
                 os.remove(graph_path)
 
-    @app_commands.command(name="list", description="List ARK servers by population (e.g. /list 60 + for >=60 players)")
-    @app_commands.describe(population="Population number", operator="Operator: + for >=, - for <=, = for exact")
+    @app_commands.command(name="list", description="List ARK servers by population, map, name or ping (e.g. /list 60 + for >=60 players)")
+    @app_commands.describe(
+        population="Population number",
+        operator="Operator: + for >=, - for <=, = for exact",
+        map_name="Only servers on this map (e.g. Ragnarok)",
+        name="Only servers whose name contains this text",
+        cluster="Cluster id (default: PVPCrossplay, 'all' for every cluster)",
+        mode="pvp (default), pve or all",
+        max_ping="Only servers with at most this ping",
+        sort="players (default), players_asc, ping or name"
+    )
     async def list(
         self,
         interaction: discord.Interaction,
-        population: int,
-        operator: str
+        population: int = None,
+        operator: str = "+",
+        map_name: str = "",
+        name: str = "",
+        cluster: str = "PVPCrossplay",
+        mode: str = "pvp",
+        max_ping: int = None,
+        sort: str = "players"
     ):
         await interaction.response.defer(thinking=True)
         if operator not in ['+', '-', '=']:
             logging.warning(f"[ark_commands.py] Invalid operator used in /list: {operator}")
             await interaction.followup.send("Operator must be one of: +, -, =", ephemeral=True)
             return
+        mode = mode.lower()
+        if mode not in MODES:
+            await interaction.followup.send(f"Mode must be one of: {', '.join(MODES)}", ephemeral=True)
+            return
+        sort = sort.lower()
+        if sort not in SORT_KEYS:
+            await interaction.followup.send(f"Sort must be one of: {', '.join(SORT_KEYS)}", ephemeral=True)
+            return
+
+        # The population operator becomes a range
+        min_players = max_players = None
+        if population is not None:
+            if operator in ('+', '='):
+                min_players = population
+            if operator in ('-', '='):
+                max_players = population
 
+        # The feed keeps a recent download around, only fetch when it has none
+        snapshot = server_list_feed.fresh_snapshot()
+        servers = snapshot.servers if snapshot else []
         max_retries = 3
-        servers = []
-        for attempt in range(max_retries):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(
-                            "https://cdn2.arkdedicated.com/servers/asa/officialserverlist.json") as response:
-                        data = await response.text()
-                servers = json.loads(data)
-                break
-            except Exception as e:
-                logging.error(f"[ark_commands.py] Failed to fetch server list (attempt {attempt+1}): {e}")
-                await asyncio.sleep(2)
+        if not servers:
+            for attempt in range(max_retries):
+                try:
+                    # Shares the download with any monitor fetching the list at the same time
+                    servers = await EOS().server_list()
+                    break
+                except Exception as e:
+                    logging.error(f"[ark_commands.py] Failed to fetch server list (attempt {attempt+1}): {e}")
+                    await asyncio.sleep(2)
 
         if not servers:
             await interaction.followup.send("Failed to fetch server list after multiple attempts.", ephemeral=True)
             return
 
-        servers_sorted = sorted(servers, key=lambda s: int(s.get('NumPlayers', 0)), reverse=True)
-
-        embeds = []
-        count = 0
-        page_servers = []
-        for server in servers_sorted:
-            # Only include servers in the PVPCrossplay cluster and only PvP servers
-            if server.get("ClusterId", "").upper() != "PVPCROSSPLAY":
-                continue
-            if server.get("SessionIsPve", 0) != 0:
-                continue
-
-            add_server = False
-            num_players = int(server.get('NumPlayers', 0))
-            if operator == '+':
-                add_server = num_players >= population
-            elif operator == '-':
-                add_server = num_players <= population
-            elif operator == '=':
-                add_server = num_players == population
-
-            if add_server:
-                page_servers.append(server)
-                count += 1
-
-        if count == 0:
+        # Indexed table, built once per download
+        page_servers = server_table(servers).query(
+            cluster=None if cluster.lower() == "all" else cluster,
+            mode=mode,
+            map_name=map_name,
+            name=name,
+            min_players=min_players,
+            max_players=max_players,
+            max_ping=max_ping,
+            sort=sort
+        )
+
+        # Short summary of the filters for the embed titles
+        filters = [f"{mode.upper()}" if mode != "all" else "ALL MODES"]
+        if population is not None:
+            filters.append(f"POPULATION {operator} {population}")
+        if map_name:
+            filters.append(f"MAP {map_name}")
+        if name:
+            filters.append(f"NAME ~ {name}")
+        if cluster.lower() != "pvpcrossplay":
+            filters.append(f"CLUSTER {cluster}")
+        if max_ping is not None:
+            filters.append(f"PING <= {max_ping}")
+        filter_str = " | ".join(filters)[:200]  # Embed titles are capped at 256 characters
+
+        if not page_servers:
             embed = discord.Embed(
-                title=f"ARK Servers with population {operator}{population}",
+                title=f"ARK Servers | {filter_str}",
                 description="No servers found matching your criteria.",
                 colour=discord.Colour.green()
             )
-            embeds.append(embed)
-        else:
-            # Split into pages of 12 for better readability with gaps
-            for i in range(0, len(page_servers), 12):
-                now = discord.utils.utcnow()
-                embed = discord.Embed(
-                    title=f"PVP SERVERS | POPULATION {operator} {population} (Page {i//12+1}/{(len(page_servers)-1)//12+1})",
-                    colour=discord.Colour.green(),
-                    timestamp=now
+            await interaction.followup.send(embed=embed)
+            return
+
+        # Pages of 12 for better readability with gaps, built as they are viewed
+        page_size = 12
+        page_count = (len(page_servers) - 1) // page_size + 1
+
+        def build_page(index):
+            embed = discord.Embed(
+                title=f"SERVERS | {filter_str} (Page {index+1}/{page_count})",
+                colour=discord.Colour.green(),
+                timestamp=discord.utils.utcnow()
+            )
+            for server in page_servers[index * page_size:(index + 1) * page_size]:
+                num_players = int(server.get('NumPlayers', 0))
+                embed.add_field(
+                    name=server.get('Name', 'Unknown'),
+                    value=(
+                        f"```Players: {num_players}\n"
+                        f"Ping: {server.get('ServerPing', 'N/A')} | IP: {server.get('IP', 'N/A')}:{server.get('Port', 'N/A')}```"
+                    ),
+                    inline=False
                 )
-                servers_on_page = page_servers[i:i+12]
-                for server in servers_on_page:
-                    num_players = int(server.get('NumPlayers', 0))
-                    embed.add_field(
-                        name=server.get('Name', 'Unknown'),
-                        value=(
-                            f"```Players: {num_players}\n"
-                            f"Ping: {server.get('ServerPing', 'N/A')} | IP: {server.get('IP', 'N/A')}:{server.get('Port', 'N/A')}```"
-                        ),
-                        inline=False
-                    )
-                embeds.append(embed)
-
-        view = ServerListView(embeds)
-        await interaction.followup.send(embed=embeds[0], view=view)
+            return embed
+
+        view = ServerListView(page_count, build_page)
+        await interaction.followup.send(embed=view.page(0), view=view)
 
     @app_commands.command(name="history", description="Show player history for an ARK server over a specified number of hours.")
     @app_commands.describe(server_number="The ARK server number (e.g., 2000)", hours="The number of hours to show history for (e.g., 6).")
@@ -267,5 +318,72 @@ class ArkCommands(commands.Cog):
             if graph_path:
                 os.remove(graph_path)
 
+    @app_commands.command(name="compare", description="Compare player history of several ARK servers in one graph.")
+    @app_commands.describe(servers="Server numbers separated by commas or spaces (e.g., 2154, 2159)", hours="The number of hours to show history for (e.g., 6).")
+    async def compare(self, interaction: discord.Interaction, servers: str, hours: int):
+        await interaction.response.defer(thinking=True)  # Extend interaction timeout
+        max_retries = 3
+        max_servers = 10
+        graph_path = None
+
+        # Parse and de-duplicate the server list, keeping the given order
+        server_numbers = []
+        for server in servers.replace(",", " ").split():
+            if server not in server_numbers:
+                server_numbers.append(server)
+
+        try:
+            if hours <= 0:
+                await interaction.followup.send("The number of hours must be greater than 0.", ephemeral=True)
+                return
+            if len(server_numbers) < 2:
+                await interaction.followup.send("Please give at least two server numbers to compare.", ephemeral=True)
+                return
+            if len(server_numbers) > max_servers:
+                await interaction.followup.send(f"You can compare at most {max_servers} servers at once.", ephemeral=True)
+                return
+            invalid = [server for server in server_numbers if not (server.isdigit() and len(server) == 4)]
+            if invalid:
+                await interaction.followup.send(f"Invalid server number(s): `{', '.join(invalid)}`.", ephemeral=True)
+                return
+
+            # Retry logic for generating the graph
+            for attempt in range(max_retries):
+                try:
+                    logging.info(f"Generating comparison graph for servers {server_numbers} over {hours} hours (attempt {attempt + 1})...")
+                    graph_path = await asyncio.wait_for(create_comparison_graph(server_numbers, hours), timeout=20)
+                    if graph_path:
+                        break
+                except asyncio.TimeoutError:
+                    logging.warning(f"Comparison graph timed out for servers {server_numbers} (attempt {attempt + 1}).")
+                except Exception as e:
+                    logging.error(f"Error generating comparison graph for servers {server_numbers} (attempt {attempt + 1}): {e}")
+            else:
+                await interaction.followup.send(
+                    f"Failed to generate comparison graph for `{', '.join(server_numbers)}` after {max_retries} attempts.",
+                    ephemeral=True
+                )
+                return
+
+            with open(graph_path, "rb") as f:
+                file_disc = discord.File(f, filename="compare.png")
+                embed = discord.Embed(
+                    title=f"Player History: {', '.join(server_numbers)}",
+                    description=f"History over the last {hours} hours.",
+                    colour=discord.Colour.blue()
+                )
+                embed.set_image(url="attachment://compare.png")
+                await interaction.followup.send(embed=embed, file=file_disc)
+
+        except Exception as e:
+            logging.error(f"Unexpected error in /compare command: {e}")
+            await interaction.followup.send(
+                "An unexpected error occurred while comparing the servers.",
+                ephemeral=True
+            )
+        finally:
+            if graph_path:
+                os.remove(graph_path)
+
 async def setup(bot):
     await bot.add_cog(ArkCommands(bot))
\ No newline at end of file
@@ -7,8 +7,28 @@ import asyncio
 from tools.EOS import EOS
 from tools.player_display import build_player_list_embeds
 from tools.connector import db_connector
+from tools.server_registry import server_registry
+from tools.player_stats import get_player_stats
+from tools.copresence import get_co_players
+from tools.alt_correlator import get_alt_candidates
 import logging
 
+# Characters used to draw the online-hours histogram, lowest to highest
+HOUR_BARS = "▁▂▃▄▅▆▇█"
+
+async def resolve_puid(identifier, conn):
+    """
+    Returns the puid for an EOS ID, Steam64, Xbox Gamertag or PSN ID, or None if unknown.
+    """
+    if identifier.startswith("0002"):
+        return identifier
+    async with conn.cursor(aiomysql.DictCursor) as cursor:
+        await cursor.execute(
+            "SELECT puid FROM players WHERE account_id = %s", (identifier,)
+        )
+        row = await cursor.fetchone()
+    return row['puid'] if row else None
+
 class PlayerListView(discord.ui.View):
     def __init__(self, embeds):
         super().__init__(timeout=120)
@@ -57,14 +77,8 @@ class EOSCommands(commands.Cog):
         max_players = 0
 
         try:
-            # Get room_id from DB
-            conn = await db_connector()
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT room_id FROM ark_servers_new WHERE ark_server = %s", (server_number,)
-                )
-                row = await cursor.fetchone()
-                room_id = row[0] if row else 0
+            # Get room_id from the in-memory server registry
+            room_id = await server_registry.room_id(server_number)
             if room_id == 0:
                 logging.warning(f"[eos_commands.py] No EOS ID found for server {server_number}.")
                 await interaction.followup.send(f"No EOS ID found for server {server_number}.", ephemeral=True)
@@ -73,10 +87,11 @@ class EOSCommands(commands.Cog):
             # Retry up to 3 times to get player info
             while retries < max_retries:
                 try:
-                    # Get player puids and info using room_id
-                    puids = await eos.players(server_number, room_id)
-                    puids_info = await eos.info(puids)
-                    server_info, total_players, max_players, _ = await eos.matchmaking(server_number)
+                    # Get player info and matchmaking data concurrently using room_id
+                    puids_info, matchmaking_result = await eos.server_snapshot(server_number, room_id)
+                    if matchmaking_result is None:
+                        raise Exception(f"No matchmaking data for server {server_number}")
+                    server_info, total_players, max_players, _ = matchmaking_result
                     if server_info == "error":
                         server_info = None
                     custom_server_name = server_info["attributes"]["CUSTOMSERVERNAME_s"] if server_info else str(server_number)
@@ -90,9 +105,13 @@ class EOSCommands(commands.Cog):
                 await interaction.followup.send(f"Failed to retrieve player info for server `{server_number}` after {max_retries} attempts.", ephemeral=True)
                 return
 
-            embeds = await build_player_list_embeds(
-                server_number, puids_info, custom_server_name, total_players, max_players, conn
-            )
+            conn = await db_connector()
+            try:
+                embeds = await build_player_list_embeds(
+                    server_number, puids_info, custom_server_name, total_players, max_players, conn
+                )
+            finally:
+                conn.close()
 
             view = PlayerListView(embeds)
             await interaction.followup.send(embed=embeds[0], view=view)
@@ -113,19 +132,13 @@ class EOSCommands(commands.Cog):
         max_retries = 3
 
         for attempt in range(max_retries):
+            conn = None
             try:
+                # One connection for every lookup of this attempt
+                conn = await db_connector()
+
                 # Resolve EOS ID
-                if identifier.startswith("0002"):
-                    puid = identifier
-                else:
-                    conn = await db_connector()
-                    async with conn.cursor(aiomysql.DictCursor) as cursor:
-                        await cursor.execute(
-                            "SELECT puid FROM players WHERE account_id = %s", (identifier,)
-                        )
-                        row = await cursor.fetchone()
-                        if row:
-                            puid = row['puid']
+                puid = await resolve_puid(identifier, conn)
 
                 if not puid:
                     logging.warning(f"[eos_commands.py] Player not found in the database for identifier: {identifier}")
@@ -153,14 +166,14 @@ class EOSCommands(commands.Cog):
                     display_name_link = f"[{display_name}](https://steamcommunity.com/profiles/{account_id})"
 
                 # Get alias and tribe/most joined server from database_tools
-                conn = await db_connector()
                 from tools.database_tools import get_user_alias, get_user_tribe_and_most_joined_server
                 alias = await get_user_alias(puid, conn)
                 tribe, most_joined_server = await get_user_tribe_and_most_joined_server(puid, conn)
 
                 # Get recent join history (10 most recent)
                 join_history_str = ""
-                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                # Small read, plain tuples are enough
+                async with conn.cursor() as cursor:
                     await cursor.execute("""
                         SELECT server_alias, timestamp 
                         FROM user_servers 
@@ -168,13 +181,19 @@ class EOSCommands(commands.Cog):
                         ORDER BY timestamp DESC
                         LIMIT 10
                     """, (puid,))
-                    data = await cursor.fetchall()
-                    for row in data:
-                        time_unix = int(row['timestamp'])
-                        join_history_str += f"Joined **{row['server_alias']}** at <t:{time_unix}>\n"
+                    for server_alias, timestamp in await cursor.fetchall():
+                        join_history_str += f"Joined **{server_alias}** at <t:{int(timestamp)}>\n"
                 if not join_history_str:
                     join_history_str = "No recent join history found."
 
+                # Accounts that repeatedly switched servers right as this one did
+                alts_str = ""
+                try:
+                    for row in await get_alt_candidates(conn, puid):
+                        alts_str += f"`{row['puid']}` ({row['count']}x, last <t:{int(row['last_seen'])}:R>)\n"
+                except Exception as e:
+                    logging.debug(f"[eos_commands.py] Could not load alt candidates for {puid}: {e}")
+
                 embed = discord.Embed(
                     title=f"Player Info",
                     colour=discord.Colour.blue()
@@ -187,6 +206,8 @@ class EOSCommands(commands.Cog):
                 embed.add_field(name="Tribe / Most Joined Server", value=f"{tribe} ({most_joined_server})", inline=False)
                 embed.add_field(name="Last Login", value=last_login, inline=False)
                 embed.add_field(name="Recent Joins", value=join_history_str, inline=False)
+                if alts_str:
+                    embed.add_field(name="Possible Alts", value=alts_str, inline=False)
 
                 await interaction.followup.send(embed=embed)
                 return
@@ -196,6 +217,122 @@ class EOSCommands(commands.Cog):
                     await interaction.followup.send(f"Error: {e}", ephemeral=True)
                 else:
                     await asyncio.sleep(2)
+            finally:
+                if conn:
+                    conn.close()
+
+    @app_commands.command(
+        name="player_stats",
+        description="Show hours played per server, usual online hours and session counts for a player"
+    )
+    @app_commands.describe(identifier="EOS ID, Steam64, Xbox Gamertag, or PSN ID")
+    async def player_stats(self, interaction: discord.Interaction, identifier: str):
+        await interaction.response.defer(thinking=True)
+        conn = await db_connector()
+        try:
+            puid = await resolve_puid(identifier, conn)
+            if not puid:
+                logging.warning(f"[eos_commands.py] Player not found in the database for identifier: {identifier}")
+                await interaction.followup.send("Player not found in the database.", ephemeral=True)
+                return
+
+            # Everything comes from the precomputed aggregates, keyed by puid
+            per_server, hour_seconds, open_session = await get_player_stats(conn, puid)
+            if not per_server and not open_session:
+                await interaction.followup.send("No session history recorded for this player yet.", ephemeral=True)
+                return
+
+            total_seconds = sum(int(row['seconds_played']) for row in per_server)
+            total_sessions = sum(int(row['sessions']) for row in per_server)
+
+            servers_str = ""
+            for row in per_server[:10]:
+                hours_played = int(row['seconds_played']) / 3600
+                servers_str += (f"**{row['server']}**: {hours_played:.1f}h over {row['sessions']} sessions "
+                                f"(last seen <t:{int(row['last_seen'])}:R>)\n")
+            if len(per_server) > 10:
+                servers_str += f"...and {len(per_server) - 10} more servers\n"
+            if not servers_str:
+                servers_str = "No finished sessions yet."
+
+            # Histogram of online time per UTC hour, plus the busiest hours
+            peak = max(hour_seconds)
+            if peak:
+                bars = "".join(HOUR_BARS[min(len(HOUR_BARS) - 1, seconds * len(HOUR_BARS) // (peak + 1))] for seconds in hour_seconds)
+                top_hours = sorted(range(24), key=lambda hour: hour_seconds[hour], reverse=True)[:3]
+                hours_str = (f"```\n{bars}\n0     6     12    18   23```"
+                             f"Most active (UTC): {', '.join(f'{hour:02d}:00' for hour in sorted(top_hours))}")
+            else:
+                hours_str = "Not enough data."
+
+            embed = discord.Embed(
+                title=f"Player Stats",
+                colour=discord.Colour.blue()
+            )
+            embed.add_field(name="EOS ID", value=puid, inline=False)
+            embed.add_field(name="Total Playtime", value=f"{total_seconds / 3600:.1f}h", inline=True)
+            embed.add_field(name="Sessions", value=str(total_sessions), inline=True)
+            if open_session:
+                embed.add_field(
+                    name="Online Now",
+                    value=f"On **{open_session[0]}** since <t:{open_session[1]}:R>",
+                    inline=False
+                )
+            embed.add_field(name="Hours per Server", value=servers_str[:1024], inline=False)
+            embed.add_field(name="Online Hours", value=hours_str, inline=False)
+
+            await interaction.followup.send(embed=embed)
+        except Exception as e:
+            logging.error(f"[eos_commands.py] Error in /player_stats for identifier {identifier}: {e}")
+            await interaction.followup.send(f"Error: {e}", ephemeral=True)
+        finally:
+            conn.close()
+
+    @app_commands.command(
+        name="co_players",
+        description="Show the players most often online on the same server as a player"
+    )
+    @app_commands.describe(identifier="EOS ID, Steam64, Xbox Gamertag, or PSN ID")
+    async def co_players(self, interaction: discord.Interaction, identifier: str):
+        await interaction.response.defer(thinking=True)
+        conn = await db_connector()
+        try:
+            puid = await resolve_puid(identifier, conn)
+            if not puid:
+                logging.warning(f"[eos_commands.py] Player not found in the database for identifier: {identifier}")
+                await interaction.followup.send("Player not found in the database.", ephemeral=True)
+                return
+
+            rows = await get_co_players(conn, puid)
+            if not rows:
+                await interaction.followup.send("No co-presence data recorded for this player yet.", ephemeral=True)
+                return
+
+            # Display names come from the product-user cache, so this is usually free
+            names = {}
+            try:
+                for player in await EOS().info([row['puid'] for row in rows]):
+                    names.setdefault(player['puid'], player['display_name'])
+            except Exception as e:
+                logging.warning(f"[eos_commands.py] Could not resolve co-player names: {e}")
+
+            lines = ""
+            for row in rows:
+                name = names.get(row['puid'], row['puid'])
+                lines += f"**{name}** — {row['count']}x, last <t:{int(row['last_seen'])}:R>\n`{row['puid']}`\n"
+
+            embed = discord.Embed(
+                title=f"Frequent Co-players",
+                description=lines[:4000],
+                colour=discord.Colour.blue()
+            )
+            embed.set_footer(text=f"PUID: {puid}")
+            await interaction.followup.send(embed=embed)
+        except Exception as e:
+            logging.error(f"[eos_commands.py] Error in /co_players for identifier {identifier}: {e}")
+            await interaction.followup.send(f"Error: {e}", ephemeral=True)
+        finally:
+            conn.close()
 
     @app_commands.command(name="set_tribe", description="Set a tribe for a specific ARK server by server number.")
     @app_commands.describe(server_number="The ARK server number (e.g., 2159)", tribe="The name of the tribe to associate with the server.")
@@ -205,12 +342,8 @@ class EOSCommands(commands.Cog):
 
         try:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
-                # Check if the server number exists in the database
-                await cursor.execute(
-                    "SELECT 1 FROM ark_servers_new WHERE ark_server = %s",
-                    (server_number,)
-                )
-                server_exists = await cursor.fetchone()
+                # Check if the server number exists (registry falls back to the DB on a miss)
+                server_exists = await server_registry.get(server_number)
 
                 if not server_exists:
                     # Server does not exist, inform the user
@@ -231,6 +364,7 @@ class EOSCommands(commands.Cog):
                     (tribe, server_number)
                 )
                 await conn.commit()
+                server_registry.update(server_number, tribe=tribe)
 
                 # Inform the user of the successful update
                 embed = discord.Embed(
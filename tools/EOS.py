@@ -3,26 +3,122 @@ import asyncio
 import json
 import aiohttp
 import random
+import re
 import websockets
 import logging
 from datetime import datetime, timezone
 import uuid
+import time
 
 from tools.connector import db_connector
+from tools.product_user_cache import product_user_cache
+from tools.single_flight import SingleFlight
+from tools.upstream_guard import upstreams, check_status, UpstreamUnavailable
 import aiomysql
 
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-flight
+_background_tasks = set()
+
+# Identical concurrent EOS calls (same server, room or puid set) share one in-flight request
+eos_calls = SingleFlight()
+
+SERVER_LIST_URL = "https://cdn2.arkdedicated.com/servers/asa/officialserverlist.json"
+
+# Client credentials token, reused until shortly before it expires
+_token_cache = {"token": None, "expires_at": 0.0}
+
+# Last good results per call, served while the upstream's circuit is open
+_last_good = {}
+LAST_GOOD_MAX_AGE = 10 * 60
+
+async def _with_last_good(key, coro):
+    """
+    Await coro and remember its result. If the upstream is unavailable, return the
+    last good result for key instead, as long as it isn't older than LAST_GOOD_MAX_AGE.
+    """
+    try:
+        result = await coro
+    except UpstreamUnavailable:
+        cached = _last_good.get(key)
+        if cached and time.monotonic() - cached[0] < LAST_GOOD_MAX_AGE:
+            logging.warning(f"[EOS.py] Upstream unavailable, serving cached result for {key}.")
+            return cached[1]
+        raise
+    if result is not None:
+        _last_good[key] = (time.monotonic(), result)
+    return result
+
+
+BAN_LIST_URL = "https://cdn2.arkdedicated.com/asa/BanList.txt"
+# How often the puid pool is re-downloaded, and how soon to retry after a failed download
+PUID_POOL_REFRESH_SECONDS = 6 * 3600
+PUID_POOL_RETRY_SECONDS = 5 * 60
+# Used until the pool has been downloaded, or when it comes back empty
+FALLBACK_PUID = "000297d4a8da4895b77ee19ac11f3bfb"
+PUID_LENGTH = 32
+PUID_PATTERN = re.compile(rb"[0-9a-f]{32}")
+
+class PuidPool:
+    '''
+    The puids we join rtc rooms as, taken from BanList.txt.
+    Downloaded once and refreshed in the background every PUID_POOL_REFRESH_SECONDS.
+    Stored packed back to back in one bytes object and handed out round-robin.
+    '''
 
-async def random_user():
-    url = "https://cdn2.arkdedicated.com/asa/BanList.txt"
+    def __init__(self):
+        self.pool = b""
+        self.size = 0
+        self.next_index = 0
+        self.refresh_at = 0.0  # monotonic time of the next download
+
+    async def next(self):
+        if time.monotonic() >= self.refresh_at:
+            self.refresh_at = time.monotonic() + PUID_POOL_RETRY_SECONDS
+            if self.size:
+                # Keep handing out the current pool while the new one downloads
+                task = asyncio.create_task(self.refresh())
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+            else:
+                await self.refresh()
+
+        if not self.size:
+            return FALLBACK_PUID
+        index = self.next_index % self.size
+        self.next_index = index + 1
+        return self.pool[index * PUID_LENGTH:(index + 1) * PUID_LENGTH].decode("ascii")
+
+    async def refresh(self):
+        try:
+            data = await upstreams["cdn"].call(self._download)
+        except Exception as e:
+            logging.error(f"[EOS.py] Failed to download ban list for the puid pool: {e}")
+            return
+
+        puids = PUID_PATTERN.findall(data.lower())
+        if not puids:
+            logging.warning("[EOS.py] Ban list contained no puids, keeping the current pool.")
+            return
+
+        self.pool = b"".join(puids)
+        self.size = len(puids)
+        # Start somewhere random so restarts don't always begin with the same puid
+        self.next_index = random.randrange(self.size)
+        self.refresh_at = time.monotonic() + PUID_POOL_REFRESH_SECONDS
+        logging.info(f"[EOS.py] Loaded {self.size} puids into the pool.")
+
+    async def _download(self):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(BAN_LIST_URL) as response:
+                check_status(response, "cdn")
+                if response.status != 200:
+                    raise Exception(f"HTTP Fail {response.status}")
+                return await response.read()
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            data = await response.text()
+puid_pool = PuidPool()
 
-    data = data.split()
-    return "000297d4a8da4895b77ee19ac11f3bfb"
-    return "LOGGER_Lethal"
-    return data[random.randint(1, len(data) - 1)][:-2]  # Adjusted to avoid index out of range
+async def random_user():
+    return await puid_pool.next()
 
 
 class EOS:
@@ -32,6 +128,20 @@ class EOS:
         self.api_url = "https://api.epicgames.dev"
 
     async def get_token(self):
+        if _token_cache["token"] and time.monotonic() < _token_cache["expires_at"]:
+            return _token_cache["token"]
+        return await eos_calls.do("token", self._get_token)
+
+    async def _get_token(self):
+        token = await upstreams["auth"].call(self._request_token)
+        # Refresh a minute early so a token never expires mid-request
+        expires_in = int(token.get("expires_in", 0))
+        if token.get("access_token") and expires_in > 60:
+            _token_cache["token"] = token
+            _token_cache["expires_at"] = time.monotonic() + expires_in - 60
+        return token
+
+    async def _request_token(self):
         url = self.api_url + "/auth/v1/oauth/token"
 
         payload = f"grant_type=client_credentials&deployment_id={self.deployment_id}"
@@ -42,6 +152,7 @@ class EOS:
 
         async with aiohttp.ClientSession() as session:
             async with session.post(url, data=payload, headers=headers) as response:
+                check_status(response, "auth")
                 token = await response.text()
 
         return json.loads(token)
@@ -67,15 +178,21 @@ class EOS:
             "Authorization": f"Bearer {token['access_token']}"
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=json.dumps(payload), headers=headers) as response:
-                data = await response.text()
+        async def request_ticket():
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, data=json.dumps(payload), headers=headers) as response:
+                    check_status(response, "rtc")
+                    return json.loads(await response.text())
 
-        data = json.loads(data)
+        data = await upstreams["rtc"].call(request_ticket)
 
         return data['clientBaseUrl'], data['participants'][0]['token'], puid
 
     async def players(self, server, room_id):
+        key = ("players", str(server), str(room_id))
+        return await _with_last_good(key, eos_calls.do(key, self._players, server, room_id))
+
+    async def _players(self, server, room_id):
         uri, ticket, puid = await self.ticket(server, room_id)
         # logging.info(f"[EOS.py] Ticket URI: {uri}, Ticket: {ticket}, PUID: {puid}")
 
@@ -117,22 +234,25 @@ class EOS:
             }
         }
 
-        async with websockets.connect(uri) as websocket:
-            await websocket.send(json.dumps(first_message))
-            response = await websocket.recv()
-
-            # Try to get the second message, but don't hang forever
-            try:
+        async def join_room():
+            async with websockets.connect(uri) as websocket:
+                await websocket.send(json.dumps(first_message))
                 response = await websocket.recv()
-                
-            except asyncio.TimeoutError:
-                logging.error("[EOS.py] Timed out waiting for second websocket message.")
+
+                # Try to get the second message, but don't hang forever
+                try:
+                    response = await websocket.recv()
+                    
+                except asyncio.TimeoutError:
+                    logging.error("[EOS.py] Timed out waiting for second websocket message.")
+                    await websocket.close()
+                    raise Exception("Timed out waiting for second websocket message.")
+
                 await websocket.close()
-                raise Exception("Timed out waiting for second websocket message.")
 
-            await websocket.close()
+                return json.loads(response)
 
-            data = json.loads(response)
+        data = await upstreams["rtc_ws"].call(join_room)
 
         users = []
         for user in data.get('users', []):
@@ -142,7 +262,98 @@ class EOS:
 
         return users
 
+    async def server_snapshot(self, server_number, room_id, with_info=True, timeout=10):
+        """
+        Fetch a server's roster and its matchmaking data concurrently.
+        The roster (players, then info when with_info is set) and matchmaking each get their own timeout.
+        Returns (roster, matchmaking_result) and raises the first error if either part failed.
+        """
+        async def roster():
+            puids = await asyncio.wait_for(self.players(server_number, room_id), timeout=timeout)
+            if not with_info:
+                return puids
+            return await asyncio.wait_for(self.info(puids), timeout=timeout)
+
+        results = await asyncio.gather(
+            roster(),
+            asyncio.wait_for(self.matchmaking(server_number), timeout=timeout),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return results[0], results[1]
+
     async def info(self, uids):
+        """
+        Returns display name, account, platform and time since last login for each puid.
+        Cached records are served straight away; stale ones are refreshed in the background
+        and only cache misses are sent to EOS before answering.
+        """
+        fresh, stale, missing = product_user_cache.classify(uids)
+
+        if missing:
+            try:
+                await eos_calls.do(("product_users", frozenset(missing)), self._fetch_product_users, missing)
+            except UpstreamUnavailable as e:
+                # Fall back to whatever we have, however old; never-seen puids are left out
+                logging.warning(f"[EOS.py] {e}; serving {len(uids) - len(missing)} cached of {len(uids)} product users.")
+
+        if stale:
+            stale = [puid for puid in stale if puid not in product_user_cache.refreshing]
+            if stale:
+                product_user_cache.refreshing.update(stale)
+                task = asyncio.create_task(self._refresh_product_users(stale))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+
+        players_info = []
+
+        now = int(datetime.now(timezone.utc).timestamp())
+
+        for puid in uids:
+            for account in product_user_cache.get(puid) or []:
+                # Time since login is computed now, from the cached timestamp
+                last_login_ts = account['last_login_ts']
+                if last_login_ts is not None:
+                    login_seconds = now - last_login_ts
+                    hours, remainder = divmod(login_seconds, 3600)
+                    minutes = remainder // 60
+                    last_login_fmt = f"{hours}h {minutes}m"
+                else:
+                    login_seconds = None
+                    last_login_fmt = "Unknown"
+
+                players_info.append({
+                    "puid": puid,
+                    "display_name": account['display_name'],
+                    "account": account['account'],
+                    "platform": account['platform'],
+                    "last_login": last_login_fmt,
+                    "login_seconds": login_seconds if login_seconds is not None else -1
+                })
+
+        # Sort players by login_seconds descending (longest logged in first)
+        players_info.sort(key=lambda x: x.get("login_seconds", -1), reverse=True)
+
+        # Remove 'login_seconds' from the returned dicts
+        for player in players_info:
+            player.pop("login_seconds", None)
+
+        return players_info
+
+    async def _refresh_product_users(self, uids):
+        try:
+            await eos_calls.do(("product_users", frozenset(uids)), self._fetch_product_users, uids)
+        except Exception as e:
+            logging.error(f"[EOS.py] Background refresh of {len(uids)} product users failed: {e}")
+        finally:
+            product_user_cache.refreshing.difference_update(uids)
+
+    async def _fetch_product_users(self, uids):
+        """
+        Fetch product users from EOS, record new accounts in the players table and update the cache.
+        """
         url = self.api_url + "/user/v9/product-users/search"
 
         payload = {"productUserIds": uids}
@@ -154,112 +365,136 @@ class EOS:
             "Authorization": f"Bearer {token['access_token']}"
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, data=json.dumps(payload), headers=headers) as response:
-                data = await response.text()
+        async def search():
+            async with aiohttp.ClientSession() as session:
+                async with session.post(url, data=json.dumps(payload), headers=headers) as response:
+                    check_status(response, "product_users")
+                    return json.loads(await response.text())
 
-        data = json.loads(data)
+        data = await upstreams["product_users"].call(search)
 
         conn = await db_connector()
 
-        players_info = []
-
-        now = datetime.now(timezone.utc)
+        records = {puid: [] for puid in uids}
 
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            for users in data['productUsers'].items():
-                puid = users[0]
-
-                for account in users[1]['accounts']:
-                    await cursor.execute("""
-                        SELECT puid
-                        FROM players
-                        WHERE puid = %s
-                        AND account_id = %s
-                        AND provider = %s
-                    """, (puid, account['accountId'], account['identityProviderId']))
-                    existing_data = await cursor.fetchone()
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                for users in data['productUsers'].items():
+                    puid = users[0]
 
-                    if not existing_data:
+                    for account in users[1]['accounts']:
                         await cursor.execute("""
-                            INSERT INTO
-                                players (puid, account_id, provider)
-                            VALUES
-                                (%s, %s, %s);
+                            SELECT puid
+                            FROM players
+                            WHERE puid = %s
+                            AND account_id = %s
+                            AND provider = %s
                         """, (puid, account['accountId'], account['identityProviderId']))
-                        await conn.commit()
-
-                    # Parse lastLogin and calculate time since login
-                    last_login_str = account.get('lastLogin')
-                    login_seconds = None
-                    if last_login_str:
-                        try:
-                            last_login_dt = datetime.strptime(last_login_str, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
-                            time_diff = now - last_login_dt
-                            login_seconds = int(time_diff.total_seconds())
-                            hours, remainder = divmod(login_seconds, 3600)
-                            minutes = remainder // 60
-                            last_login_fmt = f"{hours}h {minutes}m"
-                        except Exception as e:
-                            last_login_fmt = "Unknown"
-                    else:
-                        last_login_fmt = "Unknown"
-
-                    players_info.append({
-                        "puid": puid,
-                        "display_name": account['displayName'],
-                        "account": account['accountId'],
-                        "platform": account['identityProviderId'],
-                        "last_login": last_login_fmt,
-                        "login_seconds": login_seconds if login_seconds is not None else -1
-                    })
-
-        # Sort players by login_seconds descending (longest logged in first)
-        players_info.sort(key=lambda x: x.get("login_seconds", -1), reverse=True)
+                        existing_data = await cursor.fetchone()
+
+                        if not existing_data:
+                            await cursor.execute("""
+                                INSERT INTO
+                                    players (puid, account_id, provider)
+                                VALUES
+                                    (%s, %s, %s);
+                            """, (puid, account['accountId'], account['identityProviderId']))
+                            await conn.commit()
+
+                        # Keep lastLogin as a timestamp, the age is worked out at render time
+                        last_login_str = account.get('lastLogin')
+                        last_login_ts = None
+                        if last_login_str:
+                            try:
+                                last_login_dt = datetime.strptime(last_login_str, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+                                last_login_ts = int(last_login_dt.timestamp())
+                            except Exception:
+                                last_login_ts = None
+
+                        records.setdefault(puid, []).append({
+                            "display_name": account['displayName'],
+                            "account": account['accountId'],
+                            "platform": account['identityProviderId'],
+                            "last_login_ts": last_login_ts
+                        })
+        finally:
+            conn.close()
+
+        for puid, accounts in records.items():
+            product_user_cache.put(puid, accounts)
+
+        return records
+
+    async def server_list(self):
+        """
+        Download officialserverlist.json. Concurrent callers share one download.
+        """
+        return await _with_last_good("server_list", eos_calls.do("server_list", self._server_list))
+
+    async def fresh_server_list(self):
+        """
+        Download officialserverlist.json without falling back to the cached copy, for callers
+        that treat the result as current. A good download still refreshes the cache.
+        """
+        result = await eos_calls.do("server_list", self._server_list)
+        _last_good["server_list"] = (time.monotonic(), result)
+        return result
+
+    async def _server_list(self):
+        return await upstreams["cdn"].call(self._download_server_list)
+
+    async def _download_server_list(self):
+        async with aiohttp.ClientSession() as session:
+            async with session.get(SERVER_LIST_URL) as response:
+                check_status(response, "cdn")
+                if response.status != 200:
+                    logging.error(f"[EOS.py] Failed to fetch server data. HTTP status: {response.status}")
+                    raise Exception(f"HTTP Fail {response.status}")
 
-        # Remove 'login_seconds' from the returned dicts
-        for player in players_info:
-            player.pop("login_seconds", None)
+                data = await response.json()
 
-        return players_info
+        if not isinstance(data, list):
+            logging.error("[EOS.py] Invalid data format from the server.")
+            raise Exception("Invalid Data ")
+        return data
 
     async def matchmaking(self, server_number):
-        url = "https://cdn2.arkdedicated.com/servers/asa/officialserverlist.json"
+        key = ("matchmaking", str(server_number))
+        return await _with_last_good(key, eos_calls.do(key, self._matchmaking, server_number))
 
+    async def _matchmaking(self, server_number):
         session_id = None
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as response:
-                    if response.status != 200:
-                        logging.error(f"[EOS.py] Failed to fetch server data. HTTP status: {response.status}")
-                        raise Exception(f"HTTP Fail {response.status}")
-                    
-                    data = await response.json()
-
-                    if not isinstance(data, list):
-                        logging.error("[EOS.py] Invalid data format from the server.")
-                        raise Exception("Invalid Data ")
-                        
-                    server = next(
-                        (
-                            item
-                            for item in data
-                            if server_number in item.get("Name", "") and item.get("ClusterId") == "PVPCrossplay"
-                        ),
-                        None
-                    )
-
-                    if not server:
-                        logging.error(f"[EOS.py] No server found with number {server_number} in the specified cluster.")
-                        raise Exception(f"No server {server_number}")
-
-                    session_id = server.get("SessionID", "N/A")
-                    ip = server.get("IP", "N/A")
-                    port = server.get("Port", "N/A")
-                    total_players = server.get("NumPlayers", 0)
-                    if session_id == "N/A":
-                        logging.error(f"[EOS.py] No SessionID found for server {server_number}.")
-                        raise Exception(f"No SessionID for server {server_number}")
+            # The feed's latest download saves fetching the whole list again
+            from tools.server_list_feed import server_list_feed
+            snapshot = server_list_feed.fresh_snapshot()
+            if snapshot is not None:
+                server = snapshot.find(server_number)
+            else:
+                data = await self.server_list()
+                server = next(
+                    (
+                        item
+                        for item in data
+                        if server_number in item.get("Name", "") and item.get("ClusterId") == "PVPCrossplay"
+                    ),
+                    None
+                )
+
+            if not server:
+                logging.error(f"[EOS.py] No server found with number {server_number} in the specified cluster.")
+                raise Exception(f"No server {server_number}")
+
+            session_id = server.get("SessionID", "N/A")
+            ip = server.get("IP", "N/A")
+            port = server.get("Port", "N/A")
+            total_players = server.get("NumPlayers", 0)
+            if session_id == "N/A":
+                logging.error(f"[EOS.py] No SessionID found for server {server_number}.")
+                raise Exception(f"No SessionID for server {server_number}")
+        except UpstreamUnavailable:
+            # Let matchmaking() fall back to the last good result
+            raise
         except Exception as e:
             logging.error(f"[EOS.py] EOS Matchmaking ERROR: {e}")
             return None  # Return None if error occurs
@@ -272,9 +507,13 @@ class EOS:
             "Authorization": f"Bearer {token['access_token']}"
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                data = await response.json()
+        async def get_session():
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url, headers=headers) as response:
+                    check_status(response, "matchmaking")
+                    return await response.json()
+
+        data = await upstreams["matchmaking"].call(get_session)
         if 'publicData' not in data:
             return "error", total_players, 70, f"{ip}:{port}"
         return data['publicData'], data['publicData']['totalPlayers'], data['publicData']['settings']['maxPublicPlayers'], f"{ip}:{port}"
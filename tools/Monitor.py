@@ -10,7 +10,12 @@ import discord
 from tools.EOS import EOS
 from tools.player_display import build_player_list_embeds
 from tools.connector import db_connector
-from tools.database_tools import get_user_tribe_and_most_joined_server, create_history_graph, store_info_to_db  # Import the function
+from tools.server_registry import server_registry
+from tools.server_list_recorder import server_list_recorder
+from tools.database_tools import get_user_tribe_and_most_joined_server, create_history_graph, create_sparkline_graph, store_info_to_db  # Import the function
+
+# Type-1 posts use the matplotlib graph; set to "sparkline" for the cheaper NumPy render
+MONITOR_GRAPH_STYLE = os.getenv("MONITOR_GRAPH_STYLE", "full")
 
 class Monitor:
     '''
@@ -43,13 +48,13 @@ class Monitor:
             f"guild_id={self.guild_id}"
         )
 
-    def start(self):
-        # Start the monitor as an asyncio task
+    def start(self, initial_delay=0):
+        # Start the monitor as an asyncio task, optionally delaying the first run
         logging.info(f"Starting monitor (type {self.type_of_monitor}) for server {self.server_number} in channel {self.channel_id} of guild {self.guild_id}")
 
         if self.task is None or self.task.done():
             self.stopped = False
-            self.task = asyncio.create_task(self._run_with_restart())
+            self.task = asyncio.create_task(self._run_with_restart(initial_delay))
 
     async def stop(self):
         # Cancel the running task
@@ -61,9 +66,15 @@ class Monitor:
             except asyncio.CancelledError:
                 pass
 
-    async def _run_with_restart(self):
+    async def _run_with_restart(self, initial_delay=0):
         # Internal: run the monitor, restart if cancelled
-        
+        if initial_delay > 0:
+            try:
+                await asyncio.sleep(initial_delay)
+            except asyncio.CancelledError:
+                logging.info(f"Monitor for server {self.server_number} has been stopped before its first run.")
+                return
+
         while True:
             try:
                 await self._run_monitor()
@@ -129,12 +140,13 @@ class Monitor:
 
         # Attempt to fetch server info
         try:
-            server_info, total_players, _, _ = await eos.matchmaking(self.server_number)
+            server_info, total_players, max_players, _ = await eos.matchmaking(self.server_number)
             logging.debug(f"[Monitor.py] matchmaking returned type(server_info)={type(server_info)}")
         except Exception as e:
             logging.error(f"[Monitor.py] Failed to fetch server info for server {self.server_number}: {e}")
             server_info = None
             total_players = None
+            max_players = None
 
         # If matchmaking fails, send a red embed indicating the server is offline
         if server_info is None:
@@ -160,8 +172,10 @@ class Monitor:
             total_players = 0
 
         # --- Store player count in DB (store 0 when offline) ---
+        # Servers on the server list are already recorded from every refresh
         try:
-            await store_info_to_db(self.server_number, total_players)
+            if offline or not server_list_recorder.covers(self.server_number):
+                await store_info_to_db(self.server_number, total_players)
         except Exception as e:
             logging.error(f"[Monitor.py] Failed to store player count in DB for server {self.server_number}: {e}")
 
@@ -189,7 +203,10 @@ class Monitor:
         # --- Generate the history graph (skip when offline) ---
         if not offline:
             try:
-                graph_path = await create_history_graph(self.server_number, 1)  # Last hour
+                if MONITOR_GRAPH_STYLE == "sparkline":
+                    graph_path = await create_sparkline_graph(self.server_number, 1, max_players or 70)  # Last hour, cheap render
+                else:
+                    graph_path = await create_history_graph(self.server_number, 1)  # Last hour
             except Exception as e:
                 logging.error(f"[Monitor.py] Failed to create history graph for server {self.server_number}: {e}")
                 graph_path = None
@@ -358,22 +375,18 @@ class Monitor:
         '''\nA single monitor loop for monitors of type 2.\n'''
         eos = EOS()
         try:
-            # Efficiently fetch room_id from DB for this server
-            conn = await db_connector()
-            async with conn.cursor() as cursor:
-                await cursor.execute(
-                    "SELECT room_id FROM ark_servers_new WHERE ark_server = %s", (self.server_number,)
-                )
-                row = await cursor.fetchone()
-                room_id = row[0] if row else 0
+            # Resolve room_id from the in-memory server registry
+            room_id = await server_registry.room_id(self.server_number)
             if room_id == 0:
                 logging.error(f"[Monitor.py] No room_id found for server {self.server_number}.")
+                await asyncio.sleep(30)
                 return
 
-            # Get player puids and info using room_id
-            puids = await eos.players(self.server_number, room_id)
-            puids_info = await eos.info(puids)
-            server_info, total_players, max_players, ip_and_port = await eos.matchmaking(self.server_number)
+            # Get player info and matchmaking data concurrently
+            puids_info, matchmaking_result = await eos.server_snapshot(self.server_number, room_id)
+            if matchmaking_result is None:
+                raise Exception(f"No matchmaking data for server {self.server_number}")
+            server_info, total_players, max_players, ip_and_port = matchmaking_result
             # Use safe + normalized name here
             custom_server_name = self._normalize_server_name(self._safe_server_name(server_info))
 
@@ -392,9 +405,13 @@ class Monitor:
             return
 
         # Build embeds using the shared function
-        embeds = await build_player_list_embeds(
-            self.server_number, puids_info, custom_server_name, total_players, max_players, conn
-        )
+        conn = await db_connector()
+        try:
+            embeds = await build_player_list_embeds(
+                self.server_number, puids_info, custom_server_name, total_players, max_players, conn
+            )
+        finally:
+            conn.close()
 
         # Purge previous messages before sending new embeds
         guild = discord.utils.get(self.bot.guilds, id=self.guild_id)
@@ -424,22 +441,22 @@ class Monitor:
             prev_players = set()
 
         # Get current players
-        server_info, total_players, max_players, _ = await eos.matchmaking(self.server_number)
-        conn = await db_connector()
-        async with conn.cursor() as cursor:
-            await cursor.execute(
-                "SELECT room_id FROM ark_servers_new WHERE ark_server = %s", (self.server_number,)
-            )
-            row = await cursor.fetchone()
-            room_id = row[0] if row else 0
-
+        room_id = await server_registry.room_id(self.server_number)
         if room_id == 0:
             logging.error(f"[Monitor.py] No room_id found for server {self.server_number}.")
             await asyncio.sleep(30)
             return
 
-        puids = await eos.players(self.server_number, room_id)
-        puids_info = await eos.info(puids)
+        try:
+            puids_info, matchmaking_result = await eos.server_snapshot(self.server_number, room_id)
+            if matchmaking_result is None:
+                raise Exception(f"No matchmaking data for server {self.server_number}")
+            server_info, total_players, max_players, _ = matchmaking_result
+        except Exception as e:
+            logging.error(f"[Monitor.py] Error in run_monitor_type_3: {e}")
+            await asyncio.sleep(30)
+            return
+
         current_players = set(player['puid'] for player in puids_info)
 
         joined = current_players - prev_players
@@ -5,20 +5,171 @@ from tools.connector import db_connector
 import aiomysql
 import asyncio
 from tools.all_servers_monitor import monitor_all_servers
+from tools.server_list_feed import server_list_feed
+from tools.server_list_recorder import server_list_recorder
+from tools.ipc import COLLECTOR_SOCKET, Subscriber
+import discord
 import time
+import random
+from typing import NamedTuple
+
+# Monitors loaded at startup are spread over this window instead of all firing at once
+STARTUP_SPREAD_SECONDS = 30
+STARTUP_JITTER_SECONDS = 3
+
+# Server-list events sent to alert channels: kind -> (title, colour)
+SERVER_EVENT_ALERTS = {
+    "restart": ("Server {server} restarted", discord.Colour.orange()),
+    "disappeared": ("Server {server} dropped off the server list", discord.Colour.red()),
+    "appeared": ("Server {server} is back on the server list", discord.Colour.green()),
+}
+
+class MonitorKey(NamedTuple):
+    '''Identifies a single monitor: one server, one type, one channel.'''
+    server_number: str
+    type_of_monitor: int
+    channel_id: int
+
+    @classmethod
+    def of(cls, server_number, type_of_monitor, channel_id):
+        return cls(str(server_number), int(type_of_monitor), int(channel_id))
+
+class AlertKey(NamedTuple):
+    '''Identifies where an alert lives: one server in one guild.'''
+    server_number: str
+    guild_id: int
+
+    @classmethod
+    def of(cls, server_number, guild_id):
+        return cls(str(server_number), int(guild_id))
 
 class Monitor_Manager:
     def __init__(self, bot):
-        self.monitors = []  # Use a list to store monitors
+        self.monitors = {}  # MonitorKey -> Monitor
+        self.monitors_by_guild = {}  # AlertKey -> {MonitorKey: Monitor}, in insertion order
+        self.alert_keys_by_server = {}  # server_number -> set of AlertKey, for server-list events
         self.bot = bot
         self.all_servers_monitor_task = None
+        self._reconcile_lock = asyncio.Lock()
+        server_list_feed.subscribe(self.on_server_list)
+        server_list_feed.subscribe(server_list_recorder.record)
+        self.collector = None
+        if COLLECTOR_SOCKET:
+            # The collector process downloads and records the server list, we only follow it
+            server_list_recorder.write = False
+            self.collector = Subscriber(COLLECTOR_SOCKET, {"server_list": self.on_collector_server_list})
+
+    def _register(self, key, guild_id, monitor):
+        self.monitors[key] = monitor
+        alert_key = AlertKey.of(key.server_number, guild_id)
+        self.monitors_by_guild.setdefault(alert_key, {})[key] = monitor
+        self.alert_keys_by_server.setdefault(alert_key.server_number, set()).add(alert_key)
+        server_list_recorder.tracked.add(alert_key.server_number)
+
+    def _unregister(self, key):
+        monitor = self.monitors.pop(key, None)
+        if monitor is None:
+            return None
+        alert_key = AlertKey.of(key.server_number, monitor.guild_id)
+        guild_monitors = self.monitors_by_guild.get(alert_key)
+        if guild_monitors is not None:
+            guild_monitors.pop(key, None)
+            if not guild_monitors:
+                del self.monitors_by_guild[alert_key]
+                server_keys = self.alert_keys_by_server.get(alert_key.server_number)
+                if server_keys is not None:
+                    server_keys.discard(alert_key)
+                    if not server_keys:
+                        del self.alert_keys_by_server[alert_key.server_number]
+                        server_list_recorder.tracked.discard(alert_key.server_number)
+        return monitor
+
+    def _alert_target(self, alert_key):
+        '''The first type 1 monitor for a server in a guild, which is where alerts attach.'''
+        for key, monitor in self.monitors_by_guild.get(alert_key, {}).items():
+            if key.type_of_monitor == 1:
+                return monitor
+        return None
+
+    def apply_alerts(self, alerts):
+        '''
+        Attach a batch of alerts to their monitors.
+        alerts: iterable of (AlertKey, alert_channel_id, population_change_threshold)
+        Returns the number of alerts that found a monitor.
+        '''
+        applied = 0
+        for alert_key, alert_channel_id, population_change_threshold in alerts:
+            monitor = self._alert_target(alert_key)
+            if monitor is None:
+                logging.warning(f"[Monitor_Manager] No matching type 1 monitor for alert: "
+                                f"server={alert_key.server_number}, guild={alert_key.guild_id}")
+                continue
+            monitor.alert_channel_id = alert_channel_id
+            monitor.population_change_threshold = population_change_threshold
+            applied += 1
+        return applied
+
+    async def on_collector_server_list(self, payload):
+        # Only count the servers as recorded if the collector's write went through
+        server_list_recorder.remote_recorded = bool(payload.get("recorded"))
+        await server_list_feed.apply(payload["servers"], int(payload["timestamp"]))
+
+    async def on_server_list(self, snapshot, events):
+        '''
+        Forward restarts and servers leaving or rejoining the server list to the alert
+        channels of the servers they concern. Population jumps are left to the
+        monitors' own threshold alerts.
+        '''
+        for event in events:
+            alert = SERVER_EVENT_ALERTS.get(event.kind)
+            if alert is None or event.server_number is None or event.cluster != "PVPCrossplay":
+                continue
+            title, colour = alert
+            for alert_key in list(self.alert_keys_by_server.get(event.server_number, ())):
+                monitor = self._alert_target(alert_key)
+                if monitor is None or not monitor.alert_channel_id:
+                    continue
+                guild = self.bot.get_guild(alert_key.guild_id)
+                channel = guild.get_channel(monitor.alert_channel_id) if guild else None
+                if channel is None:
+                    continue
+                embed = discord.Embed(
+                    title=title.format(server=event.server_number),
+                    description=f"{event.name}: {event.old_players} -> {event.new_players} players",
+                    colour=colour,
+                    timestamp=discord.utils.utcnow()
+                )
+                try:
+                    await channel.send(embed=embed)
+                except Exception as e:
+                    logging.error(f"[Monitor_Manager] Failed to send {event.kind} alert for server {event.server_number}: {e}")
+
+    async def reconcile_monitors(self):
+        """
+        Bring the in-memory monitors in line with the database.
+        Only monitors that are missing or whose task has died are started, so
+        this is safe to call on every gateway (re)connect.
+        """
+        async with self._reconcile_lock:
+            await self.load_monitors_from_db()
+            await self.start_monitors()
 
     async def start_monitors(self):
         """
-        Start all individual monitors.
+        Start all individual monitors, staggered over STARTUP_SPREAD_SECONDS with a
+        little random jitter so they don't all hit EOS at the same instant.
         """
-        for monitor in self.monitors:  # Iterate directly over the list
-            monitor.start()  # No await needed
+        pending = [monitor for monitor in self.monitors.values() if monitor.task is None or monitor.task.done()]
+        for idx, monitor in enumerate(pending):
+            delay = (idx / len(pending)) * STARTUP_SPREAD_SECONDS + random.uniform(0, STARTUP_JITTER_SECONDS)
+            monitor.start(initial_delay=delay)  # No await needed
+        logging.info(f"[Monitor_Manager] Scheduled {len(pending)} monitors over {STARTUP_SPREAD_SECONDS}s.")
+        # One server-list download per interval for the whole bot, diffed for events,
+        # unless a collector process does the downloading for us
+        if self.collector:
+            self.collector.start()
+        else:
+            server_list_feed.start()
         # Start or restart the all_servers_monitor as a background task
         async def run_all_servers_monitor_with_restart():
             while True:
@@ -37,24 +188,28 @@ class Monitor_Manager:
 
     async def load_monitors_from_db(self):
         """
-        Load all monitors from the database and initialize them.
+        Load all monitors and their alerts from the database in a single query.
+        Monitors are only initialized here, start_monitors() starts them.
         """
         t0 = time.monotonic()
         logging.info("[Monitor_Manager] load_monitors_from_db: start")
         conn = await db_connector()
         try:
-            # ---------------- Monitors ----------------
-            t_m0 = time.monotonic()
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 try:
-                    logging.info("[Monitor_Manager] Fetching monitors from monitors_new_upd...")
-                    # Timeout wrappers to detect stalls
+                    logging.info("[Monitor_Manager] Fetching monitors and alerts...")
+                    # Alerts only ever attach to type 1 monitors of the same server and guild
                     await asyncio.wait_for(cursor.execute("""
-                        SELECT ark_server, type, channel_id, guild_id
-                        FROM monitors_new_upd
+                        SELECT m.ark_server, m.type, m.channel_id, m.guild_id,
+                               a.population_change, a.alert_channel
+                        FROM monitors_new_upd m
+                        LEFT JOIN alert_servers a
+                            ON m.type = 1
+                            AND a.server_number = m.ark_server
+                            AND a.guild_id = m.guild_id
                     """), timeout=10)
-                    monitors = await asyncio.wait_for(cursor.fetchall(), timeout=10)
-                    logging.info(f"[Monitor_Manager] Monitors fetched: count={len(monitors)} (took {(time.monotonic()-t_m0):.3f}s)")
+                    rows = await asyncio.wait_for(cursor.fetchall(), timeout=10)
+                    logging.info(f"[Monitor_Manager] Monitors fetched: count={len(rows)} (took {(time.monotonic()-t0):.3f}s)")
                 except asyncio.TimeoutError:
                     logging.error("[Monitor_Manager] Timeout while fetching monitors from DB.")
                     return
@@ -62,82 +217,40 @@ class Monitor_Manager:
                     logging.error(f"[Monitor_Manager] Failed to fetch monitors: {e}")
                     return
 
-                # Initialize monitors
-                init_ok = 0
-                for idx, monitor_data in enumerate(monitors):
-                    try:
-                        server_number = str(monitor_data['ark_server'])
-                        type_of_monitor = int(monitor_data['type'])
-                        channel_id = int(monitor_data['channel_id'])
-                        guild_id = int(monitor_data['guild_id'])
-
-                        logging.debug(f"[Monitor_Manager] Init monitor[{idx}] "
-                                      f"server={server_number}, type={type_of_monitor}, "
-                                      f"channel={channel_id}, guild={guild_id}")
-                        monitor = Monitor(server_number, type_of_monitor, channel_id, guild_id, self.bot)
-                        monitor.start()
-                        self.monitors.append(monitor)
-                        init_ok += 1
-                    except Exception as e:
-                        logging.error(f"[Monitor_Manager] Failed to init/start monitor {monitor_data}: {e}")
-
-                logging.info(f"[Monitor_Manager] Initialized monitors: ok={init_ok}/{len(monitors)}; total_in_memory={len(self.monitors)}")
-
-            # ---------------- Alerts ----------------
-            logging.info("[Monitor_Manager] Loading alerts for monitors from database.")
-            t_a0 = time.monotonic()
-            async with conn.cursor(aiomysql.DictCursor) as cursor:
+            # Initialize monitors, skipping the ones already in memory, then attach alerts
+            init_ok = 0
+            skipped = 0
+            alerts = {}  # AlertKey -> (alert_channel_id, threshold); the join repeats them per monitor
+            for idx, monitor_data in enumerate(rows):
                 try:
-                    logging.info("[Monitor_Manager] Fetching alerts from alert_servers...")
-                    await asyncio.wait_for(cursor.execute("""
-                        SELECT server_number, guild_id, population_change, alert_channel
-                        FROM alert_servers
-                    """), timeout=10)
-                    alerts = await asyncio.wait_for(cursor.fetchall(), timeout=10)
-                    logging.info(f"[Monitor_Manager] Alerts fetched: count={len(alerts)} (took {(time.monotonic()-t_a0):.3f}s)")
-                    if alerts:
-                        sample = alerts[:3]
-                        logging.debug(f"[Monitor_Manager] Alerts sample(3): {sample}")
-                except asyncio.TimeoutError:
-                    logging.error("[Monitor_Manager] Timeout while fetching alerts from DB.")
-                    return
-                except Exception as e:
-                    logging.error(f"[Monitor_Manager] Failed to fetch alerts from alert_servers: {e}")
-                    return
+                    key = MonitorKey.of(monitor_data['ark_server'], monitor_data['type'], monitor_data['channel_id'])
+                    guild_id = int(monitor_data['guild_id'])
 
-                # Map alerts to monitors
-                applied = 0
-                for idx, alert_data in enumerate(alerts):
-                    try:
-                        server_number = str(alert_data['server_number'])
-                        guild_id = int(alert_data['guild_id'])
-                        population_change_threshold = int(alert_data['population_change'])
-                        alert_channel_id = int(alert_data['alert_channel'])
-
-                        logging.debug(f"[Monitor_Manager] Apply alert[{idx}] server={server_number}, guild={guild_id}, "
-                                      f"thresh={population_change_threshold}, channel={alert_channel_id}; "
-                                      f"monitors_in_memory={len(self.monitors)}")
-
-                        success = await self.add_alert_to_monitor(
-                            server_number=server_number,
-                            guild_id=guild_id,
-                            alert_channel_id=alert_channel_id,
-                            population_change_threshold=population_change_threshold
+                    if monitor_data['alert_channel'] is not None:
+                        alerts.setdefault(
+                            AlertKey.of(key.server_number, guild_id),
+                            (int(monitor_data['alert_channel']), int(monitor_data['population_change']))
                         )
 
-                        if success:
-                            applied += 1
-                            logging.info(
-                                f"[Monitor_Manager] Loaded alert OK: server={server_number}, guild={guild_id}, "
-                                f"channel={alert_channel_id}, threshold={population_change_threshold}"
-                            )
-                        else:
-                            logging.warning(f"[Monitor_Manager] No matching type 1 monitor for alert: server={server_number}, guild={guild_id}")
-                    except Exception as e:
-                        logging.error(f"[Monitor_Manager] Failed to apply alert {alert_data}: {e}")
+                    if key in self.monitors:
+                        skipped += 1
+                        continue
+
+                    logging.debug(f"[Monitor_Manager] Init monitor[{idx}] "
+                                  f"server={key.server_number}, type={key.type_of_monitor}, "
+                                  f"channel={key.channel_id}, guild={guild_id}")
+                    monitor = Monitor(key.server_number, key.type_of_monitor, key.channel_id, guild_id, self.bot)
+                    self._register(key, guild_id, monitor)
+                    init_ok += 1
+                except Exception as e:
+                    logging.error(f"[Monitor_Manager] Failed to init monitor {monitor_data}: {e}")
 
-                logging.info(f"[Monitor_Manager] Alerts applied: {applied}/{len(alerts)}")
+            applied = self.apply_alerts(
+                (alert_key, channel_id, threshold) for alert_key, (channel_id, threshold) in alerts.items()
+            )
 
+            logging.info(f"[Monitor_Manager] Initialized monitors: ok={init_ok}/{len(rows)}; already_loaded={skipped}; "
+                         f"alerts_applied={applied}/{len(alerts)}; total_in_memory={len(self.monitors)}")
             logging.info(f"[Monitor_Manager] load_monitors_from_db: done in {(time.monotonic()-t0):.3f}s; monitors_in_memory={len(self.monitors)}")
         except asyncio.CancelledError:
             logging.warning("[Monitor_Manager] load_monitors_from_db cancelled.")
@@ -153,42 +266,30 @@ class Monitor_Manager:
 
     async def add_monitor(self, server_number, type_of_monitor, channel_id, guild_id):
         """
-        Add a new monitor to the list.
+        Add a new monitor to the registry.
         """
-        # Check if a monitor with the same server_number, type_of_monitor, and channel_id already exists
-        for monitor in self.monitors:
-            if (
-                str(monitor.server_number) == str(server_number) and
-                str(monitor.type_of_monitor) == str(type_of_monitor) and
-                str(monitor.channel_id) == str(channel_id)
-            ):
-                logging.warning(f"Monitor for server {server_number}, type {type_of_monitor}, channel {channel_id} already exists.")
-                return
+        key = MonitorKey.of(server_number, type_of_monitor, channel_id)
+        if key in self.monitors:
+            logging.warning(f"Monitor for server {server_number}, type {type_of_monitor}, channel {channel_id} already exists.")
+            return
 
         # Create and start the new monitor
-        monitor = Monitor(server_number, type_of_monitor, channel_id, guild_id, self.bot)
-        self.monitors.append(monitor)
+        monitor = Monitor(key.server_number, key.type_of_monitor, key.channel_id, int(guild_id), self.bot)
+        self._register(key, int(guild_id), monitor)
         monitor.start()
         logging.info(f"Added monitor for server {server_number}, type {type_of_monitor}, channel {channel_id}, guild {guild_id}.")
 
     async def remove_monitor(self, server_number, type_of_monitor, channel_id, guild_id):
         """
-        Remove an existing monitor from the list.
+        Remove an existing monitor from the registry.
         """
-        # Find the monitor to remove
-        for monitor in self.monitors:
-            if (
-                str(monitor.server_number) == str(server_number) and
-                str(monitor.type_of_monitor) == str(type_of_monitor) and
-                str(monitor.channel_id) == str(channel_id)
-            ):
-                # Stop and remove the monitor
-                self.monitors.remove(monitor)
-                await monitor.stop()
-                logging.info(f"Removed monitor for server {server_number}, type {type_of_monitor}, channel {channel_id}, guild {guild_id}.")
-                return
-
-        logging.warning(f"Monitor for server {server_number}, type {type_of_monitor}, channel {channel_id} does not exist.")
+        monitor = self._unregister(MonitorKey.of(server_number, type_of_monitor, channel_id))
+        if monitor is None:
+            logging.warning(f"Monitor for server {server_number}, type {type_of_monitor}, channel {channel_id} does not exist.")
+            return
+
+        await monitor.stop()
+        logging.info(f"Removed monitor for server {server_number}, type {type_of_monitor}, channel {channel_id}, guild {guild_id}.")
 
     async def add_alert_to_monitor(self, server_number, guild_id, alert_channel_id, population_change_threshold):
         """
@@ -198,37 +299,29 @@ class Monitor_Manager:
                       f"channel={alert_channel_id}, threshold={population_change_threshold}, "
                       f"monitors_in_memory={len(self.monitors)}")
 
-        for i, monitor in enumerate(self.monitors):
-            if (
-                str(monitor.server_number) == str(server_number) and  # Convert both to strings for comparison
-                monitor.guild_id == guild_id and
-                monitor.type_of_monitor == 1
-            ):
-                # Update the monitor's alert parameters
-                monitor.alert_channel_id = alert_channel_id
-                monitor.population_change_threshold = population_change_threshold
-                logging.info(f"Added alert to monitor for server {server_number} in guild {guild_id}: "
-                             f"alert_channel_id={alert_channel_id}, population_change_threshold={population_change_threshold}")
-                return True  # Alert added successfully
-
-        logging.warning(f"No monitor of type 1 found for server {server_number} in guild {guild_id} to add an alert.")
-        return False  # No matching monitor found
+        monitor = self._alert_target(AlertKey.of(server_number, guild_id))
+        if monitor is None:
+            logging.warning(f"No monitor of type 1 found for server {server_number} in guild {guild_id} to add an alert.")
+            return False  # No matching monitor found
+
+        # Update the monitor's alert parameters
+        monitor.alert_channel_id = alert_channel_id
+        monitor.population_change_threshold = population_change_threshold
+        logging.info(f"Added alert to monitor for server {server_number} in guild {guild_id}: "
+                     f"alert_channel_id={alert_channel_id}, population_change_threshold={population_change_threshold}")
+        return True  # Alert added successfully
 
     async def remove_alert_from_monitor(self, server_number, guild_id):
         """
         Remove an alert from an existing monitor of type 1.
         """
-        for monitor in self.monitors:  # Iterate directly over the list
-            if (
-                str(monitor.server_number) == str(server_number) and
-                monitor.guild_id == guild_id and
-                monitor.type_of_monitor == 1
-            ):
-                # Clear the monitor's alert parameters
-                monitor.alert_channel_id = None
-                monitor.population_change_threshold = None
-                logging.info(f"Removed alert from monitor for server {server_number} in guild {guild_id}.")
-                return True  # Alert removed successfully
-
-        logging.warning(f"No monitor of type 1 found for server {server_number} in guild {guild_id} to remove an alert.")
-        return False  # No matching monitor found
+        monitor = self._alert_target(AlertKey.of(server_number, guild_id))
+        if monitor is None:
+            logging.warning(f"No monitor of type 1 found for server {server_number} in guild {guild_id} to remove an alert.")
+            return False  # No matching monitor found
+
+        # Clear the monitor's alert parameters
+        monitor.alert_channel_id = None
+        monitor.population_change_threshold = None
+        logging.info(f"Removed alert from monitor for server {server_number} in guild {guild_id}.")
+        return True  # Alert removed successfully
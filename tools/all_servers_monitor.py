@@ -3,7 +3,13 @@ import asyncio
 import logging
 from tools.EOS import EOS
 from tools.connector import db_connector
-import aiomysql
+from tools.server_registry import server_registry
+from tools.session_store import ensure_session_schema, close_orphaned_sessions, record_roster_diffs
+from tools.player_stats import ensure_player_stats_schema, update_player_stats
+from tools.copresence import ensure_copresence_schema, copresence_index
+from tools.alt_correlator import ensure_alt_schema, alt_correlator
+from tools.history_store import history_store
+from tools.server_list_recorder import server_list_recorder
 import time
 import json
 import os
@@ -25,11 +31,8 @@ async def fetch_players_for_server(eos, ark_server, room_id):
     Fetch players for a specific server using the EOS players and matchmaking methods.
     """
     try:
-        # Fetch player data using the EOS players method
-        players = await eos.players(ark_server, room_id)
-
-        # Fetch total player count using the EOS matchmaking method
-        matchmaking_result = await eos.matchmaking(ark_server)
+        # Fetch the roster and the total player count concurrently
+        players, matchmaking_result = await eos.server_snapshot(ark_server, room_id, with_info=False)
         if matchmaking_result is None:
             logging.warning(f"No matchmaking data returned for server {ark_server}.")
             total_players = 0
@@ -41,17 +44,20 @@ async def fetch_players_for_server(eos, ark_server, room_id):
         return ark_server, players, total_players  # Return server, player list, and total player count
     except Exception as e:
         logging.error(f"Error fetching players for server {ark_server}: {e}")
-        return ark_server, [], 0  # Return empty player list and total players as 0
+        return ark_server, None, 0  # None means "unknown", so the roster diff is skipped
 
 async def store_players_to_db(conn, ark_server, new_players, timestamp, total_players=None):
+    if total_players is not None and server_list_recorder.covers(ark_server):
+        # The server-list recorder already wrote this server's population
+        total_players = None
     async with conn.cursor() as cursor:
-        for puid in new_players:
-            await cursor.execute(
+        if new_players:
+            await cursor.executemany(
                 """
                 INSERT INTO user_servers (puid, server_alias, timestamp)
                 VALUES (%s, %s, %s)
                 """,
-                (puid, ark_server, timestamp)
+                [(puid, ark_server, timestamp) for puid in new_players]
             )
         if total_players is not None:
             await cursor.execute(
@@ -62,6 +68,8 @@ async def store_players_to_db(conn, ark_server, new_players, timestamp, total_pl
                 (ark_server, total_players, timestamp)
             )
         await conn.commit()
+    if total_players is not None:
+        history_store.ingest(ark_server, total_players, timestamp)
 
 async def monitor_all_servers(batch_size=50):
     """
@@ -72,45 +80,80 @@ async def monitor_all_servers(batch_size=50):
     conn = await db_connector()
     servers = []
 
-    # Load previous state from file
-    state = load_state()
-
-    async with conn.cursor(aiomysql.DictCursor) as cursor:
-        await cursor.execute("SELECT ark_server, room_id, tribe FROM ark_servers_new")
-        servers = await cursor.fetchall()
-
-    total_servers = len(servers)
-    logging.info(f"[all_servers_monitor.py] Starting monitoring for {total_servers} servers in batches of {batch_size}.")
-
-    # Process servers in batches
-    for i in range(0, total_servers, batch_size):
-        batch = servers[i:i + batch_size]
-        logging.info(f"[all_servers_monitor.py] Processing batch {i // batch_size + 1} with {len(batch)} servers.")
-
-        # Prepare tasks for the current batch
-        tasks = [
-            fetch_players_for_server(eos, server['ark_server'], server['room_id'])
-            for server in batch
-        ]
-
-        # Run all tasks concurrently for the current batch
-        results = await asyncio.gather(*tasks)
-
-        # Store results in the database only for new players
-        timestamp = int(time.time())
-        for ark_server, players, total_players in results:
-            ark_server_str = str(ark_server)
-            prev_players = set(state.get(ark_server_str, []))
-            current_players = set(players)
-            new_players = current_players - prev_players
-            if new_players:
-                await store_players_to_db(conn, ark_server, new_players, timestamp, total_players)
-                logging.info(f"[all_servers_monitor.py] Stored {len(new_players)} new players for server {ark_server} at {timestamp}.")
-            # Update state
-            state[ark_server_str] = list(current_players)
-
-        # Optional: Add a delay between batches to avoid overwhelming the system
-        await asyncio.sleep(5)
+    try:
+        # Load previous state from file
+        state = load_state()
+
+        # Sessions on servers we have no previous roster for can't be trusted to still be open
+        await ensure_session_schema(conn)
+        await ensure_player_stats_schema(conn)
+        await ensure_copresence_schema(conn)
+        await ensure_alt_schema(conn)
+        orphaned = await close_orphaned_sessions(conn, list(state.keys()), int(time.time()))
+        await update_player_stats(conn, orphaned)
+
+        # One query per sweep, which also refreshes the registry for everyone else
+        servers = await server_registry.load(conn)
+
+        total_servers = len(servers)
+        logging.info(f"[all_servers_monitor.py] Starting monitoring for {total_servers} servers in batches of {batch_size}.")
+
+        # Process servers in batches
+        for i in range(0, total_servers, batch_size):
+            batch = servers[i:i + batch_size]
+            logging.info(f"[all_servers_monitor.py] Processing batch {i // batch_size + 1} with {len(batch)} servers.")
+
+            # Prepare tasks for the current batch
+            tasks = [
+                fetch_players_for_server(eos, server['ark_server'], server['room_id'])
+                for server in batch
+            ]
+
+            # Run all tasks concurrently for the current batch
+            results = await asyncio.gather(*tasks)
+
+            # Store results in the database only for new players
+            timestamp = int(time.time())
+            diffs = []
+            observed = []
+            for ark_server, players, total_players in results:
+                if players is None:
+                    # Fetch failed, keep the previous roster instead of treating everyone as gone
+                    continue
+                ark_server_str = str(ark_server)
+                observed.append(ark_server_str)
+                prev_players = set(state.get(ark_server_str, []))
+                current_players = set(players)
+                new_players = current_players - prev_players
+                left_players = prev_players - current_players
+                if new_players:
+                    await store_players_to_db(conn, ark_server, new_players, timestamp, total_players)
+                    logging.info(f"[all_servers_monitor.py] Stored {len(new_players)} new players for server {ark_server} at {timestamp}.")
+                if new_players or left_players:
+                    diffs.append((ark_server_str, new_players, left_players))
+                # Without a previous roster everyone looks new, which says nothing about who travels together
+                if new_players and ark_server_str in state:
+                    copresence_index.observe(current_players, new_players)
+                # Update state
+                state[ark_server_str] = list(current_players)
+
+            # Open and close sessions for the whole batch in bulk
+            if diffs:
+                closed_sessions = await record_roster_diffs(conn, diffs, timestamp)
+                await update_player_stats(conn, closed_sessions)
+            # Unchanged servers count too, they bound the window their next changes are matched in
+            alt_correlator.observe(diffs, timestamp, observed)
+            if copresence_index.needs_flush():
+                await copresence_index.flush(conn, timestamp)
+
+            # Optional: Add a delay between batches to avoid overwhelming the system
+            await asyncio.sleep(5)
+
+        # Add this sweep's co-presence counts and alt candidates to their tables
+        await copresence_index.flush(conn, int(time.time()))
+        await alt_correlator.flush(conn)
+    finally:
+        conn.close()
 
     # Save updated state to file
     save_state(state)
@@ -0,0 +1,181 @@
+# Streaming alt-account correlation: one account leaving a server as another joins elsewhere
+import logging
+
+import aiomysql
+
+ALT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS alt_candidates (
+        left_puid VARCHAR(32) NOT NULL,
+        joined_puid VARCHAR(32) NOT NULL,
+        count INT UNSIGNED NOT NULL DEFAULT 0,
+        last_seen INT UNSIGNED NOT NULL DEFAULT 0,
+        last_from_server VARCHAR(16) NOT NULL,
+        last_to_server VARCHAR(16) NOT NULL,
+        PRIMARY KEY (left_puid, joined_puid),
+        KEY idx_joined_puid (joined_puid)
+    )
+"""
+
+# Each server is only seen once per sweep, so a leave and a join can be observed up to a
+# full sweep apart. A join is matched against the leaves observed since its server was
+# previously observed (and a leave against the joins since its server was), never further
+# back than this.
+TRANSFER_WINDOW_SECONDS = 900
+# Leaves and joins are indexed in buckets this many seconds wide, then by server
+BUCKET_SECONDS = 30
+# More leaves than this from one server in one sweep batch looks like a crash or restart
+MAX_LEAVES_PER_SERVER = 10
+# A join (or leave) that matches more events than this is too ambiguous to record
+MAX_CANDIDATES_PER_JOIN = 5
+FLUSH_CHUNK_SIZE = 5000
+
+async def ensure_alt_schema(conn):
+    async with conn.cursor() as cursor:
+        await cursor.execute(ALT_SCHEMA)
+    await conn.commit()
+
+class AltCorrelator:
+    '''
+    Indexes leave and join events by time bucket and server. A player who left server A
+    between two observations of A, while another joined server B between two observations
+    of B, may have switched accounts if those two intervals overlap. Each new batch is
+    matched against the events already seen inside that overlap, in both directions, so
+    every pair is looked at once whichever server the sweep reached first. Puids that
+    themselves joined (or left) somewhere in the window are travelling and never matched.
+    '''
+
+    def __init__(self):
+        self.leaves = {}  # bucket number -> {from_server: [(puid, timestamp)]}
+        self.joins = {}  # bucket number -> {to_server: [(puid, timestamp)]}
+        self.joiners = {}  # bucket number -> set of puids that joined a server in that bucket
+        self.leavers = {}  # bucket number -> set of puids that left a server in that bucket
+        self.observed_at = {}  # ark_server -> timestamp of its last observation
+        self.pending = {}  # (left_puid, joined_puid) -> [count, last_seen, from_server, to_server]
+
+    def _events(self, index, since, until, exclude_server, travelling):
+        """
+        (puid, server) of the events in index observed in (since, until], except on exclude_server.
+        """
+        events = []
+        for number in range(since // BUCKET_SECONDS, until // BUCKET_SECONDS + 1):
+            for server, entries in index.get(number, {}).items():
+                if server == exclude_server:
+                    continue
+                events.extend(
+                    (puid, server)
+                    for puid, seen in entries
+                    if since < seen <= until and puid not in travelling
+                )
+        return events
+
+    def _count(self, left_puid, joined_puid, from_server, to_server, timestamp):
+        entry = self.pending.setdefault((left_puid, joined_puid), [0, 0, from_server, to_server])
+        entry[0] += 1
+        entry[1] = timestamp
+        entry[2] = from_server
+        entry[3] = to_server
+
+    def observe(self, diffs, timestamp, observed=()):
+        """
+        diffs: list of (ark_server, joined_puids, left_puids) seen at timestamp.
+        observed: every server whose roster was read at timestamp, changed or not.
+        """
+        bucket = timestamp // BUCKET_SECONDS
+        oldest = timestamp - TRANSFER_WINDOW_SECONDS
+        batch = []  # (server, joined, left, previous observation)
+        for ark_server, joined, left in diffs:
+            server = str(ark_server)
+            if len(left) > MAX_LEAVES_PER_SERVER:
+                left = ()
+            batch.append((server, joined, left, max(self.observed_at.get(server, oldest), oldest)))
+
+        # Index the batch first, same-batch transfers are matched like any other
+        leaves = self.leaves.setdefault(bucket, {})
+        joins = self.joins.setdefault(bucket, {})
+        bucket_joiners = self.joiners.setdefault(bucket, set())
+        bucket_leavers = self.leavers.setdefault(bucket, set())
+        for server, joined, left, _ in batch:
+            if left:
+                leaves.setdefault(server, []).extend((puid, timestamp) for puid in left)
+            if joined:
+                joins.setdefault(server, []).extend((puid, timestamp) for puid in joined)
+            bucket_joiners.update(joined)
+            bucket_leavers.update(left)
+
+        # Players who left one server and joined another themselves are travelling, not alts
+        joiners = set().union(*self.joiners.values())
+        leavers = set().union(*self.leavers.values())
+
+        for server, joined, left, previous in batch:
+            # Joins here against leaves observed since this server was last read, this batch included
+            joined = [puid for puid in joined if puid not in leavers]
+            if joined:
+                candidates = self._events(self.leaves, previous, timestamp, server, joiners)
+                if 0 < len(candidates) <= MAX_CANDIDATES_PER_JOIN:
+                    for joined_puid in joined:
+                        for left_puid, from_server in candidates:
+                            self._count(left_puid, joined_puid, from_server, server, timestamp)
+            # Leaves here against joins observed before this batch; this batch's were matched above
+            left = [puid for puid in left if puid not in joiners]
+            if left:
+                candidates = self._events(self.joins, previous, timestamp - 1, server, leavers)
+                if 0 < len(candidates) <= MAX_CANDIDATES_PER_JOIN:
+                    for left_puid in left:
+                        for joined_puid, to_server in candidates:
+                            self._count(left_puid, joined_puid, server, to_server, timestamp)
+
+        for server in observed:
+            self.observed_at[str(server)] = timestamp
+        for server, _, _, _ in batch:
+            self.observed_at[server] = timestamp
+
+        # Drop buckets that have slid out of the window
+        first_bucket = oldest // BUCKET_SECONDS
+        for index in (self.leaves, self.joins, self.joiners, self.leavers):
+            for number in [number for number in index if number < first_bucket]:
+                del index[number]
+
+    async def flush(self, conn):
+        if not self.pending:
+            return
+        rows = [(left, joined, *entry) for (left, joined), entry in self.pending.items()]
+        self.pending = {}
+
+        async with conn.cursor() as cursor:
+            for i in range(0, len(rows), FLUSH_CHUNK_SIZE):
+                await cursor.executemany(
+                    """
+                    INSERT INTO alt_candidates
+                        (left_puid, joined_puid, count, last_seen, last_from_server, last_to_server)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        count = count + VALUES(count),
+                        last_seen = GREATEST(last_seen, VALUES(last_seen)),
+                        last_from_server = VALUES(last_from_server),
+                        last_to_server = VALUES(last_to_server)
+                    """,
+                    rows[i:i + FLUSH_CHUNK_SIZE]
+                )
+        await conn.commit()
+        logging.info(f"[alt_correlator.py] Flushed {len(rows)} alt candidate pairs.")
+
+async def get_alt_candidates(conn, puid, min_count=2, limit=5):
+    """
+    Returns likely alts of a player in either direction, strongest first.
+    """
+    async with conn.cursor(aiomysql.DictCursor) as cursor:
+        await cursor.execute(
+            """
+            (SELECT joined_puid AS puid, count, last_seen FROM alt_candidates
+             WHERE left_puid = %s AND count >= %s)
+            UNION ALL
+            (SELECT left_puid AS puid, count, last_seen FROM alt_candidates
+             WHERE joined_puid = %s AND count >= %s)
+            ORDER BY count DESC
+            LIMIT %s
+            """,
+            (puid, min_count, puid, min_count, limit)
+        )
+        return await cursor.fetchall()
+
+alt_correlator = AltCorrelator()
@@ -0,0 +1,157 @@
+# Bulk export/import of the big tables as compressed columnar chunks
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from decimal import Decimal
+
+import aiomysql
+import numpy as np
+
+from tools.connector import db_connector
+
+TABLES = ("ark_servers_history", "user_servers", "players")
+MANIFEST_FILE = "manifest.json"
+# Rows per chunk file; also the fetchmany size, so memory stays at about one chunk
+CHUNK_ROWS = 200000
+# Rows per executemany on import
+INSERT_BATCH_ROWS = 10000
+
+def _column_array(values):
+    """
+    Turn one column of a chunk into (kind, arrays) without pickling.
+    Integers become int64, floats float64, bytes one uint8 blob plus offsets and
+    everything else fixed-width unicode. Decimals are kept as their exact text.
+    """
+    nulls = np.fromiter((value is None for value in values), dtype=bool, count=len(values))
+    present = [value for value in values if value is not None]
+    if present and all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        return "int", {"c": np.array([0 if value is None else value for value in values], dtype=np.int64), "n": nulls}
+    if present and all(isinstance(value, (int, float)) for value in present):
+        return "float", {"c": np.array([0 if value is None else value for value in values], dtype=np.float64), "n": nulls}
+    if present and all(isinstance(value, (bytes, bytearray)) for value in present):
+        blobs = [b"" if value is None else bytes(value) for value in values]
+        offsets = np.zeros(len(blobs) + 1, dtype=np.int64)
+        np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+        return "bytes", {"c": np.frombuffer(b"".join(blobs), dtype=np.uint8), "o": offsets, "n": nulls}
+    kind = "decimal" if present and all(isinstance(value, Decimal) for value in present) else "str"
+    return kind, {"c": np.array(["" if value is None else str(value) for value in values], dtype=str), "n": nulls}
+
+def _write_chunk(path, columns, rows):
+    arrays = {}
+    kinds = []
+    for i, values in enumerate(zip(*rows)):
+        kind, column_arrays = _column_array(values)
+        kinds.append(kind)
+        for key, array in column_arrays.items():
+            arrays[f"{key}{i}"] = array
+    np.savez_compressed(path, columns=np.array(columns, dtype=str), kinds=np.array(kinds, dtype=str), **arrays)
+
+def _read_chunk(path):
+    """
+    Returns (columns, rows) with NULLs restored and plain Python values.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        columns = data["columns"].tolist()
+        kinds = data["kinds"].tolist() if "kinds" in data.files else [None] * len(columns)
+        values = []
+        for i, kind in enumerate(kinds):
+            if kind == "bytes":
+                blob, offsets = data[f"c{i}"].tobytes(), data[f"o{i}"].tolist()
+                column = [blob[offsets[row]:offsets[row + 1]] for row in range(len(offsets) - 1)]
+            elif kind == "decimal":
+                column = [Decimal(value) if value else None for value in data[f"c{i}"].tolist()]
+            else:
+                column = data[f"c{i}"].tolist()
+            for row in np.flatnonzero(data[f"n{i}"]):
+                column[row] = None
+            values.append(column)
+    return columns, list(zip(*values))
+
+async def export_table(conn, table, directory):
+    """
+    Stream a table through a server-side cursor into chunk files.
+    """
+    table_dir = os.path.join(directory, table)
+    os.makedirs(table_dir, exist_ok=True)
+    chunks = []
+    total = 0
+    async with conn.cursor(aiomysql.SSCursor) as cursor:
+        await cursor.execute(f"SELECT * FROM `{table}`")
+        columns = [column[0] for column in cursor.description]
+        while True:
+            rows = await cursor.fetchmany(CHUNK_ROWS)
+            if not rows:
+                break
+            name = f"chunk_{len(chunks):05d}.npz"
+            _write_chunk(os.path.join(table_dir, name), columns, rows)
+            chunks.append({"file": name, "rows": len(rows)})
+            total += len(rows)
+            logging.info(f"[bulk_transfer.py] {table}: exported {total} rows.")
+    return {"columns": columns, "chunks": chunks, "rows": total}
+
+async def import_table(conn, table, directory, manifest):
+    """
+    Load a table's chunk files with batched multi-row INSERTs.
+    Rows that already exist (same unique key) are skipped, so an import can be re-run.
+    """
+    table_dir = os.path.join(directory, table)
+    total = 0
+    async with conn.cursor() as cursor:
+        # Foreign keys are skipped for the load; unique checks stay on, INSERT IGNORE relies on them
+        await cursor.execute("SET SESSION foreign_key_checks = 0")
+        try:
+            for chunk in manifest["chunks"]:
+                columns, rows = _read_chunk(os.path.join(table_dir, chunk["file"]))
+                column_list = ", ".join(f"`{column}`" for column in columns)
+                placeholders = ", ".join(["%s"] * len(columns))
+                query = f"INSERT IGNORE INTO `{table}` ({column_list}) VALUES ({placeholders})"
+                for i in range(0, len(rows), INSERT_BATCH_ROWS):
+                    await cursor.executemany(query, rows[i:i + INSERT_BATCH_ROWS])
+                await conn.commit()
+                total += len(rows)
+                logging.info(f"[bulk_transfer.py] {table}: imported {total}/{manifest['rows']} rows.")
+        finally:
+            await cursor.execute("SET SESSION foreign_key_checks = 1")
+    return total
+
+async def export_tables(directory, tables=TABLES):
+    start_time = time.time()
+    os.makedirs(directory, exist_ok=True)
+    manifest = {"exported_at": int(start_time), "tables": {}}
+    conn = await db_connector()
+    try:
+        for table in tables:
+            manifest["tables"][table] = await export_table(conn, table, directory)
+    finally:
+        conn.close()
+    with open(os.path.join(directory, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    logging.info(f"[bulk_transfer.py] Export done in {time.time() - start_time:.2f} seconds.")
+
+async def import_tables(directory, tables=None):
+    start_time = time.time()
+    with open(os.path.join(directory, MANIFEST_FILE), "r") as f:
+        manifest = json.load(f)
+    conn = await db_connector()
+    try:
+        for table in tables or manifest["tables"]:
+            await import_table(conn, table, directory, manifest["tables"][table])
+    finally:
+        conn.close()
+    logging.info(f"[bulk_transfer.py] Import done in {time.time() - start_time:.2f} seconds.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import history and join tables as compressed chunks.")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("--dir", required=True, help="Directory holding the manifest and chunk files")
+    parser.add_argument("--tables", nargs="+", choices=TABLES, help="Only these tables (default: all)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    if args.action == "export":
+        asyncio.run(export_tables(args.dir, args.tables or TABLES))
+    else:
+        asyncio.run(import_tables(args.dir, args.tables))
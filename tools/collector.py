@@ -0,0 +1,58 @@
+# Standalone collector: server-list polling, the all-servers sweep and their DB writes
+import argparse
+import asyncio
+import logging
+
+from tools.all_servers_monitor import monitor_all_servers
+from tools.ipc import Publisher, DEFAULT_SOCKET_PATH
+from tools.server_list_feed import server_list_feed
+from tools.server_list_recorder import server_list_recorder
+
+# Pause between the end of one all-servers sweep and the start of the next
+SWEEP_PAUSE_SECONDS = 60
+
+async def run_sweeps(pause=SWEEP_PAUSE_SECONDS):
+    while True:
+        try:
+            await monitor_all_servers()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"[collector.py] Sweep crashed: {e}")
+        await asyncio.sleep(pause)
+
+async def run_collector(socket_path=DEFAULT_SOCKET_PATH, sweep=True):
+    """
+    Run the collection side of the bot in its own process. Every server-list download
+    is recorded to ark_servers_history here and forwarded to the bot over the socket.
+    """
+    publisher = Publisher(socket_path)
+    await publisher.start()
+
+    async def forward_server_list(snapshot, events):
+        # The recorder runs first; the bot only trusts coverage for snapshots it actually wrote
+        recorded = server_list_recorder.recorded_at == snapshot.timestamp
+        await publisher.publish("server_list", {"timestamp": snapshot.timestamp, "recorded": recorded,
+                                                "servers": snapshot.servers})
+
+    server_list_feed.subscribe(server_list_recorder.record)
+    server_list_feed.subscribe(forward_server_list)
+    server_list_feed.start()
+
+    tasks = [server_list_feed.task]
+    if sweep:
+        tasks.append(asyncio.create_task(run_sweeps()))
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await server_list_feed.stop()
+        await publisher.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect server data for the bot in a separate process.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help="Unix socket the bot subscribes to (COLLECTOR_SOCKET)")
+    parser.add_argument("--no-sweep", action="store_true", help="Only poll the server list, don't run the all-servers sweep")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    asyncio.run(run_collector(args.socket, sweep=not args.no_sweep))
@@ -52,3 +52,7 @@ async def add_ark_server(conn, ark_server, room_id, tribe):
             (str(ark_server), int(room_id), str(tribe))
         )
         await conn.commit()
+
+    # Keep the in-memory registry in sync (imported here to avoid a circular import)
+    from tools.server_registry import server_registry
+    server_registry.update(ark_server, room_id=room_id, tribe=str(tribe))
@@ -0,0 +1,116 @@
+# Co-presence index: how often pairs of players are online on the same server together
+import logging
+import time
+
+import aiomysql
+
+COPRESENCE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS player_copresence (
+        puid_a VARCHAR(32) NOT NULL,
+        puid_b VARCHAR(32) NOT NULL,
+        count INT UNSIGNED NOT NULL DEFAULT 0,
+        last_seen INT UNSIGNED NOT NULL DEFAULT 0,
+        PRIMARY KEY (puid_a, puid_b),
+        KEY idx_puid_b (puid_b)
+    )
+"""
+
+# Rows per executemany when flushing
+FLUSH_CHUNK_SIZE = 5000
+# Flush early if a sweep produces more pending pairs than this
+MAX_PENDING_PAIRS = 500000
+# Pairs seen fewer than PRUNE_MIN_COUNT times and not for PRUNE_AFTER_DAYS are dropped
+PRUNE_MIN_COUNT = 3
+PRUNE_AFTER_DAYS = 14
+PRUNE_INTERVAL_SECONDS = 6 * 3600
+
+async def ensure_copresence_schema(conn):
+    async with conn.cursor() as cursor:
+        await cursor.execute(COPRESENCE_SCHEMA)
+    await conn.commit()
+
+class CoPresenceIndex:
+    '''
+    Counts, for each pair of puids, how many times one of them joined a server while
+    the other was on it (or both joined together). Only pairs that actually met are
+    stored, with puid_a < puid_b.
+
+    Counts are buffered in memory for one sweep and then added to player_copresence
+    in bulk, so memory only holds the current sweep's pairs. Weak pairs that haven't
+    been seen for a while are pruned from the table.
+    '''
+
+    def __init__(self):
+        self.pending = {}  # (puid_a, puid_b) -> count
+        self.last_prune = 0.0
+
+    def observe(self, roster, joined):
+        """
+        Count a server's joins against its current roster.
+        """
+        roster = list(roster)
+        for new_puid in joined:
+            for other in roster:
+                if other == new_puid or (other in joined and other < new_puid):
+                    # Skip self, and count pairs of simultaneous joiners only once
+                    continue
+                pair = (new_puid, other) if new_puid < other else (other, new_puid)
+                self.pending[pair] = self.pending.get(pair, 0) + 1
+
+    def needs_flush(self):
+        return len(self.pending) >= MAX_PENDING_PAIRS
+
+    async def flush(self, conn, timestamp):
+        if not self.pending:
+            return
+        rows = [(a, b, count, timestamp) for (a, b), count in self.pending.items()]
+        self.pending = {}
+
+        async with conn.cursor() as cursor:
+            for i in range(0, len(rows), FLUSH_CHUNK_SIZE):
+                await cursor.executemany(
+                    """
+                    INSERT INTO player_copresence (puid_a, puid_b, count, last_seen)
+                    VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        count = count + VALUES(count),
+                        last_seen = GREATEST(last_seen, VALUES(last_seen))
+                    """,
+                    rows[i:i + FLUSH_CHUNK_SIZE]
+                )
+        await conn.commit()
+        logging.info(f"[copresence.py] Flushed {len(rows)} co-presence pairs.")
+
+        if time.monotonic() - self.last_prune >= PRUNE_INTERVAL_SECONDS:
+            await self.prune(conn, timestamp)
+
+    async def prune(self, conn, timestamp):
+        cutoff = timestamp - PRUNE_AFTER_DAYS * 86400
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                "DELETE FROM player_copresence WHERE count < %s AND last_seen < %s",
+                (PRUNE_MIN_COUNT, cutoff)
+            )
+            pruned = cursor.rowcount
+        await conn.commit()
+        self.last_prune = time.monotonic()
+        logging.info(f"[copresence.py] Pruned {pruned} weak co-presence pairs.")
+
+async def get_co_players(conn, puid, limit=15):
+    """
+    Returns the players most often online with puid, as dicts with puid, count and last_seen.
+    """
+    async with conn.cursor(aiomysql.DictCursor) as cursor:
+        await cursor.execute(
+            """
+            (SELECT puid_b AS puid, count, last_seen FROM player_copresence WHERE puid_a = %s)
+            UNION ALL
+            (SELECT puid_a AS puid, count, last_seen FROM player_copresence WHERE puid_b = %s)
+            ORDER BY count DESC
+            LIMIT %s
+            """,
+            (puid, puid, limit)
+        )
+        return await cursor.fetchall()
+
+copresence_index = CoPresenceIndex()
@@ -1,17 +1,21 @@
 # Database tools for storing and retrieving ARK server and player information
+import asyncio
 import datetime
 import logging
+import time
 from datetime import datetime, timedelta, timezone
 
 from pytz import utc, timezone as pytz_timezone
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
-import matplotlib.ticker as ticker
 import discord
+import numpy as np
 import os
 
 from tools.EOS import EOS
 from tools.connector import db_connector
+from tools.server_registry import server_registry
+from tools.history_store import history_store, bucket_average
+from tools.history_archive import history_archive
+from tools.graph_renderer import _load_matplotlib, align_series, apply_time_axis, history_renderer, render_sparkline
 import aiomysql
 
 
@@ -30,6 +34,9 @@ async def store_info_to_db(server_number, num_players):
         """, (server_number, num_players, epoch_time))
         await conn.commit()  # Commit the transaction
 
+    # Keep the in-memory copy of recent history in step with the table
+    history_store.ingest(server_number, num_players, epoch_time)
+
     return None
 
 async def get_user_alias(puid, conn=None):
@@ -57,6 +64,25 @@ async def get_user_alias(puid, conn=None):
         return result['alias']
     return "No Alias"
 
+async def get_player_groups(puids, conn):
+    """
+    Returns {puid: group_label} for the players tools/tribe_inference.py has labelled.
+    """
+    if not puids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(puids))
+    try:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                f"SELECT puid, group_label FROM player_groups WHERE puid IN ({placeholders})",
+                list(puids)
+            )
+            return {puid: group_label for puid, group_label in await cursor.fetchall()}
+    except Exception as e:
+        # The table only exists once the inference job has run
+        logging.debug(f"[database_tools.py] Could not load player groups: {e}")
+        return {}
+
 async def get_user_tribe_and_most_joined_server(puid, conn=None):
     """
     Returns (tribe, server_alias) for the server the user has joined most.
@@ -80,104 +106,254 @@ async def get_user_tribe_and_most_joined_server(puid, conn=None):
             (puid,)
         )
         row = await cursor.fetchone()
-        if row:
-            server_alias = row['server_alias']
-            # Now get the tribe for that server
-            await cursor.execute(
-                "SELECT tribe FROM ark_servers_new WHERE ark_server = %s",
-                (server_alias,)
-            )
-            tribe_row = await cursor.fetchone()
-            tribe = tribe_row['tribe'] if tribe_row and tribe_row['tribe'] else "Unknown"
-            return tribe, server_alias
     if close_conn:
         conn.close()
+    if row:
+        server_alias = row['server_alias']
+        # Now get the tribe for that server from the in-memory registry
+        tribe = await server_registry.tribe(server_alias)
+        return tribe or "Unknown", server_alias
     return "Unknown", None
 
+# Longer windows are averaged into buckets so every series has about this many points
+HISTORY_TARGET_POINTS = 720
+# Windows up to this many hours are returned raw
+HISTORY_RAW_HOURS = 24
+# Rows per round-trip when streaming history from the server-side cursor
+HISTORY_FETCH_CHUNK_ROWS = 5000
+
+def history_bucket_seconds(hours):
+    """
+    Bucket size for a history window, 0 means raw rows.
+    """
+    if hours <= HISTORY_RAW_HOURS:
+        return 0
+    # Round to whole minutes so buckets line up between calls
+    return max(60, (hours * 3600 // HISTORY_TARGET_POINTS) // 60 * 60)
+
+async def fetch_history(server_numbers, start_ts, bucket_seconds=0):
+    """
+    Fetch player history for one or more servers.
+    With bucket_seconds the rows are averaged per bucket, so wide windows stay small.
+    Recent windows of servers this process writes are answered from the history store,
+    the archived part of long windows from the memory-mapped archive, and the rest from
+    MySQL in a single query.
+    Returns {server_number: (times, players)} as NumPy arrays sorted by time.
+    """
+    server_numbers = [str(server) for server in server_numbers]
+    history = await history_store.query(server_numbers, start_ts, bucket_seconds)
+    server_numbers = [server for server in server_numbers if server not in history]
+    if not server_numbers:
+        return history
+
+    # Everything before split is in the archive; keep buckets from straddling the split
+    split = history_archive.refresh() + 1
+    if bucket_seconds:
+        split = split // bucket_seconds * bucket_seconds
+    if start_ts >= split:
+        history.update(await _fetch_history_db(server_numbers, start_ts, bucket_seconds))
+        return history
+
+    recent = await _fetch_history_db(server_numbers, split, bucket_seconds)
+    for server in server_numbers:
+        times, players = history_archive.read(server, start_ts, split)
+        times, players = bucket_average(times, players.astype(np.float32), bucket_seconds)
+        recent_times, recent_players = recent[server]
+        history[server] = (
+            np.concatenate([times, recent_times]),
+            np.concatenate([players, recent_players]),
+        )
+    return history
+
+async def _fetch_history_db(server_numbers, start_ts, bucket_seconds=0):
+    """
+    The MySQL part of fetch_history: one IN (...) query, bucketed in SQL for wide windows.
+    """
+    placeholders = ", ".join(["%s"] * len(server_numbers))
+    if bucket_seconds:
+        # Group on the bucket number itself (ONLY_FULL_GROUP_BY), it's scaled back to a time below
+        query = f"""
+            SELECT ark_server, time DIV %s AS bucket, AVG(players) AS players
+            FROM ark_servers_history
+            WHERE ark_server IN ({placeholders}) AND time >= %s
+            GROUP BY ark_server, bucket
+            ORDER BY ark_server, bucket
+        """
+        params = [bucket_seconds, *server_numbers, start_ts]
+    else:
+        query = f"""
+            SELECT ark_server, time, players
+            FROM ark_servers_history
+            WHERE ark_server IN ({placeholders}) AND time >= %s
+            ORDER BY ark_server, time
+        """
+        params = [*server_numbers, start_ts]
+
+    # Rows arrive grouped by server; preallocate for about one row a minute (or one per bucket)
+    # and grow if a server writes more often than that
+    span = max(0, int(time.time()) - int(start_ts))
+    capacity = len(server_numbers) * (span // (bucket_seconds or 60) + 2)
+    servers = np.empty(capacity, dtype=np.int32)
+    times = np.empty(capacity, dtype=np.int64)
+    players = np.empty(capacity, dtype=np.float32)
+    server_index = {server: i for i, server in enumerate(server_numbers)}
+    count = 0
+
+    conn = await db_connector()
+    try:
+        async with conn.cursor(aiomysql.SSCursor) as cursor:
+            await cursor.execute(query, params)
+            while True:
+                chunk = await cursor.fetchmany(HISTORY_FETCH_CHUNK_ROWS)
+                if not chunk:
+                    break
+                end = count + len(chunk)
+                if end > len(times):
+                    new_capacity = max(end, 2 * len(times))
+                    servers = np.resize(servers, new_capacity)
+                    times = np.resize(times, new_capacity)
+                    players = np.resize(players, new_capacity)
+                servers[count:end] = [server_index.get(str(row[0]), -1) for row in chunk]
+                times[count:end] = [row[1] for row in chunk]
+                players[count:end] = [row[2] for row in chunk]
+                count = end
+    finally:
+        conn.close()
+
+    # Slice each server's run out of the flat columns
+    servers, times, players = servers[:count], times[:count], players[:count]
+    if bucket_seconds:
+        times *= bucket_seconds
+    empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+    history = {server: empty for server in server_numbers}
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(servers)) + 1, [count]])
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if lo < hi and servers[lo] >= 0:
+            history[server_numbers[servers[lo]]] = (times[lo:hi], players[lo:hi])
+    return history
+
 async def create_history_graph(server_number: str, amount: int):
     try:
         # Calculate the time delta
         end_time = datetime.utcnow()
         start_time = end_time - timedelta(hours=amount)
 
-        # Fetch data from the database
-        conn = await db_connector()
-        async with conn.cursor(aiomysql.DictCursor) as cursor:
-            await cursor.execute("""
-                SELECT players, time
-                FROM ark_servers_history
-                WHERE ark_server = %s AND time >= %s
-            """, (server_number, int(start_time.timestamp())))
-            data = await cursor.fetchall()
-
-        if not data:
+        # Fetch max players using EOS matchmaking while the history query runs
+        eos = EOS()
+        matchmaking_task = asyncio.create_task(asyncio.wait_for(eos.matchmaking(server_number), timeout=10))
+
+        # Fetch data from the database, bucketed for wide windows
+        try:
+            history = await fetch_history(
+                [server_number], int(start_time.replace(tzinfo=timezone.utc).timestamp()), history_bucket_seconds(amount)
+            )
+        except BaseException:
+            matchmaking_task.cancel()
+            raise
+        times, players = history[str(server_number)]
+
+        try:
+            matchmaking_result = await matchmaking_task
+        except Exception as e:
+            logging.warning(f"Could not fetch max players for server {server_number}: {e}")
+            matchmaking_result = None
+
+        if len(times) == 0:
             logging.warning(f"No data found for server {server_number} in the last {amount} hours.")
             return None
 
-        # Extract players and time data
-        players_data = [record['players'] for record in data]
-        time_data = [datetime.fromtimestamp(record['time'], timezone.utc) for record in data]
-
-        # Fetch max players using EOS matchmaking
-        eos = EOS()
-        _, _, max_players, _ = await eos.matchmaking(server_number)
+        max_players = matchmaking_result[2] if matchmaking_result else None
         if not max_players:
             max_players = 70  # Default to 70 if max_players is not available
 
-        # Create the graph
+        # Draw into the cached figure template for this window and y-limit
+        fname = f"graphs/{server_number}_{int(end_time.timestamp())}.png"
+        os.makedirs("graphs", exist_ok=True)
+        history_renderer.render(
+            fname, times, players,
+            f"Server {server_number} Player History (Last {amount} Hours)",
+            amount, max_players,
+            start_time.replace(tzinfo=timezone.utc).timestamp(), end_time.replace(tzinfo=timezone.utc).timestamp(),
+        )
+
+        return fname  # Return the file path instead of the Discord file object
+
+    except Exception as e:
+        logging.warning(f"Could not generate graph for server {server_number}: {e}")
+        return None
+
+async def create_comparison_graph(server_numbers, amount: int):
+    """
+    Overlay the player history of several servers in one chart.
+    All servers are fetched in one query and resampled onto a shared time grid.
+    """
+    try:
+        end_ts = int(datetime.now(timezone.utc).timestamp())
+        start_ts = end_ts - amount * 3600
+        bucket_seconds = history_bucket_seconds(amount)
+
+        history = await fetch_history(server_numbers, start_ts, bucket_seconds)
+        if not any(len(times) for times, _ in history.values()):
+            logging.warning(f"No data found for servers {server_numbers} in the last {amount} hours.")
+            return None
+
+        # Shared grid: the bucket size, or one point a minute for raw windows
+        step = bucket_seconds or 60
+        grid = np.arange(start_ts - start_ts % step, end_ts + 1, step, dtype=np.int64)
+        series = {
+            server: align_series(times, players, grid, max_gap=3 * step)
+            for server, (times, players) in history.items()
+        }
+        peak = max((np.nanmax(values) for values in series.values() if not np.all(np.isnan(values))), default=0)
+
+        plt, _, _ = _load_matplotlib()
+        grid_dates = [datetime.fromtimestamp(ts, timezone.utc) for ts in grid.tolist()]
         fig, ax = plt.subplots(figsize=(10, 6))
-        ax.plot(time_data, players_data, label="Players", color="blue", linewidth=2)
+        for server, values in series.items():
+            ax.plot(grid_dates, values, label=f"{server}", linewidth=2)
 
-        # Set graph title and labels
-        ax.set_title(f"Server {server_number} Player History (Last {amount} Hours)", fontsize=14, weight="bold")
+        ax.set_title(f"Player History Comparison (Last {amount} Hours)", fontsize=14, weight="bold")
         ax.set_xlabel("Time (UTC)", fontsize=12)
         ax.set_ylabel("Players", fontsize=12)
+        ax.legend(loc="upper left", fontsize=9)
 
-        # Dynamically adjust the x-axis tick intervals based on the time range
-        if amount <= 1:  # 1 hour or less
-            major_locator = mdates.MinuteLocator(interval=10)  # Major ticks every 10 minutes
-            minor_locator = mdates.MinuteLocator(interval=2)   # Minor ticks every 2 minutes
-        elif amount <= 6:  # Up to 6 hours
-            major_locator = mdates.MinuteLocator(interval=30)  # Major ticks every 30 minutes
-            minor_locator = mdates.MinuteLocator(interval=5)   # Minor ticks every 5 minutes
-        elif amount <= 12:  # Up to 24 hours
-            major_locator = mdates.HourLocator(interval=1)     # Major ticks every 1 hour
-            minor_locator = mdates.MinuteLocator(interval=15)  # Minor ticks every 15 minutes
-        elif amount <= 24:  # Up to 24 hours
-            major_locator = mdates.HourLocator(interval=2)     # Major ticks every 2 hour
-            minor_locator = mdates.MinuteLocator(interval=30)  # Minor ticks every 30 minutes
-        elif amount <= 48: # Up to 2 days
-            major_locator = mdates.HourLocator(interval=4)     # Major ticks every 4 hours
-            minor_locator = mdates.HourLocator(interval=1)     # Minor ticks every 1 hour
-        elif amount <= 96: # Up to 4 days
-            major_locator = mdates.HourLocator(interval=12)    # Major ticks every 12 hours
-            minor_locator = mdates.HourLocator(interval=3)     # Minor ticks every 3 hours
-        else:  # More than 4 days
-            major_locator = mdates.DayLocator(interval=1)     # Major ticks every 1 day
-            minor_locator = mdates.HourLocator(interval=4)     # Minor ticks every 4 hours
-
-        # Apply the locators to the x-axis
-        ax.xaxis.set_major_locator(major_locator)
-        ax.xaxis.set_minor_locator(minor_locator)
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))  # Format time as HH:MM
-
-        # Add grid lines
-        ax.grid(True, which='major', linestyle='--', linewidth=0.5, alpha=0.7)
-        ax.grid(True, which='minor', linestyle=':', linewidth=0.3, alpha=0.5)
-
-        # Format the y-axis
-        ax.yaxis.set_major_locator(ticker.MultipleLocator(5))
-        ax.yaxis.set_minor_locator(ticker.AutoMinorLocator())
-        ax.set_ylim(0, max_players)  # Set the y-axis limit to max players
-
-        # Save the graph to a temporary file
-        fname = f"graphs/{server_number}_{int(end_time.timestamp())}.png"
+        apply_time_axis(ax, amount, max(70, int(peak) + 5))
+
+        fname = f"graphs/compare_{'_'.join(str(server) for server in server_numbers)}_{end_ts}.png"
         os.makedirs("graphs", exist_ok=True)
         fig.savefig(fname=fname)
-        plt.close(fig)  # Close the figure to release the file
+        plt.close(fig)
 
-        return fname  # Return the file path instead of the Discord file object
+        return fname
 
     except Exception as e:
-        logging.warning(f"Could not generate graph for server {server_number}: {e}")
+        logging.warning(f"Could not generate comparison graph for servers {server_numbers}: {e}")
+        return None
+
+async def create_sparkline_graph(server_number: str, amount: int, max_players=70):
+    """
+    Cheap history image for routine monitor posts, rasterized with NumPy instead of matplotlib.
+    """
+    try:
+        end_ts = int(datetime.now(timezone.utc).timestamp())
+        start_ts = end_ts - amount * 3600
+        history = await fetch_history([server_number], start_ts, history_bucket_seconds(amount))
+        times, players = history[str(server_number)]
+        if len(times) == 0:
+            logging.warning(f"No data found for server {server_number} in the last {amount} hours.")
+            return None
+
+        # Leave headroom if the server is over the expected cap
+        max_players = max(max_players, int(players.max()) + 5)
+        step = history_bucket_seconds(amount) or 60
+        png = render_sparkline(times, players, start_ts, end_ts, max_players, max_gap=3 * step)
+
+        fname = f"graphs/{server_number}_{end_ts}_spark.png"
+        os.makedirs("graphs", exist_ok=True)
+        with open(fname, "wb") as f:
+            f.write(png)
+        return fname
+
+    except Exception as e:
+        logging.warning(f"Could not generate sparkline for server {server_number}: {e}")
         return None
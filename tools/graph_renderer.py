@@ -0,0 +1,202 @@
+# Graph rendering: cached matplotlib figure templates and a pure NumPy sparkline
+import logging
+import struct
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Figures kept around for reuse, one per (window, y-limit)
+MAX_TEMPLATES = 16
+
+SPARKLINE_WIDTH = 480
+SPARKLINE_HEIGHT = 120
+SPARKLINE_BACKGROUND = (47, 49, 54)  # Discord dark theme
+SPARKLINE_GRID = (64, 68, 75)
+SPARKLINE_FILL = (44, 82, 130)
+SPARKLINE_LINE = (88, 166, 255)
+
+_matplotlib = None
+
+def _load_matplotlib():
+    """
+    Import matplotlib on first use so the bot does not pay for it at startup.
+    Returns (pyplot, dates, ticker).
+    """
+    global _matplotlib
+    if _matplotlib is None:
+        import matplotlib
+        matplotlib.use("Agg")  # Headless backend, we only ever save to file
+        import matplotlib.pyplot as plt
+        import matplotlib.dates as mdates
+        import matplotlib.ticker as ticker
+        _matplotlib = (plt, mdates, ticker)
+    return _matplotlib
+
+def align_series(times, values, grid, max_gap):
+    """
+    Resample a series onto a shared time grid. Grid points inside a gap longer than
+    max_gap, or further than max_gap outside the data, become NaN so lines break there.
+    """
+    aligned = np.full(len(grid), np.nan, dtype=np.float32)
+    if len(times) == 0:
+        return aligned
+    aligned[:] = np.interp(grid, times, values)
+    # Width of the sample interval each grid point falls into, outside the data it's the distance to the edge
+    right = np.clip(np.searchsorted(times, grid), 0, len(times) - 1)
+    left = np.clip(right - 1, 0, len(times) - 1)
+    span = np.where(
+        grid < times[0], times[0] - grid,
+        np.where(grid > times[-1], grid - times[-1], times[right] - times[left])
+    )
+    span[times[right] == grid] = 0  # Grid points that land on a sample are always kept
+    aligned[span > max_gap] = np.nan
+    return aligned
+
+def time_locators(amount, mdates):
+    """
+    Major and minor x-axis locators for a window of amount hours.
+    """
+    if amount <= 1:  # 1 hour or less
+        return mdates.MinuteLocator(interval=10), mdates.MinuteLocator(interval=2)
+    if amount <= 6:  # Up to 6 hours
+        return mdates.MinuteLocator(interval=30), mdates.MinuteLocator(interval=5)
+    if amount <= 12:  # Up to 12 hours
+        return mdates.HourLocator(interval=1), mdates.MinuteLocator(interval=15)
+    if amount <= 24:  # Up to 24 hours
+        return mdates.HourLocator(interval=2), mdates.MinuteLocator(interval=30)
+    if amount <= 48:  # Up to 2 days
+        return mdates.HourLocator(interval=4), mdates.HourLocator(interval=1)
+    if amount <= 96:  # Up to 4 days
+        return mdates.HourLocator(interval=12), mdates.HourLocator(interval=3)
+    # More than 4 days
+    return mdates.DayLocator(interval=1), mdates.HourLocator(interval=4)
+
+def apply_time_axis(ax, amount, max_players):
+    """
+    Locators, grid and y-axis shared by the history graphs.
+    """
+    _, mdates, ticker = _load_matplotlib()
+    major_locator, minor_locator = time_locators(amount, mdates)
+    ax.xaxis.set_major_locator(major_locator)
+    ax.xaxis.set_minor_locator(minor_locator)
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))  # Format time as HH:MM
+
+    # Add grid lines
+    ax.grid(True, which='major', linestyle='--', linewidth=0.5, alpha=0.7)
+    ax.grid(True, which='minor', linestyle=':', linewidth=0.3, alpha=0.5)
+
+    # Format the y-axis
+    ax.yaxis.set_major_locator(ticker.MultipleLocator(5))
+    ax.yaxis.set_minor_locator(ticker.AutoMinorLocator())
+    ax.set_ylim(0, max_players)  # Set the y-axis limit to max players
+
+class HistoryGraphRenderer:
+    '''
+    Builds a history figure (axes, locators, grid, labels) once per (window, y-limit)
+    and keeps it. Later renders with the same key only swap the line data, x-range
+    and title before saving, which skips almost all of the figure setup cost.
+    '''
+
+    def __init__(self, max_templates=MAX_TEMPLATES):
+        self.max_templates = max_templates
+        self.templates = OrderedDict()  # (amount, max_players) -> (fig, ax, line)
+
+    def _template(self, amount, max_players):
+        key = (amount, max_players)
+        template = self.templates.get(key)
+        if template is not None:
+            self.templates.move_to_end(key)
+            return template
+
+        plt, _, _ = _load_matplotlib()
+        fig, ax = plt.subplots(figsize=(10, 6))
+        line, = ax.plot([], [], label="Players", color="blue", linewidth=2)
+        ax.set_xlabel("Time (UTC)", fontsize=12)
+        ax.set_ylabel("Players", fontsize=12)
+        apply_time_axis(ax, amount, max_players)
+
+        template = self.templates[key] = (fig, ax, line)
+        if len(self.templates) > self.max_templates:
+            _, (old_fig, _, _) = self.templates.popitem(last=False)
+            plt.close(old_fig)
+        logging.debug(f"[graph_renderer.py] Built graph template for {amount}h / {max_players} players.")
+        return template
+
+    def render(self, fname, times, players, title, amount, max_players, start_ts, end_ts):
+        """
+        Draw times (unix seconds) / players into the cached template and save it to fname.
+        """
+        _, mdates, _ = _load_matplotlib()
+        fig, ax, line = self._template(amount, max_players)
+        line.set_data(
+            mdates.date2num(np.asarray(times, dtype="datetime64[s]")),
+            np.asarray(players, dtype=np.float32),
+        )
+        ax.set_xlim(
+            mdates.date2num(np.datetime64(int(start_ts), "s")),
+            mdates.date2num(np.datetime64(int(end_ts), "s")),
+        )
+        ax.set_title(title, fontsize=14, weight="bold")
+        fig.savefig(fname=fname)
+        return fname
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+def encode_png(pixels):
+    """
+    Encode an (height, width, 3) uint8 array as PNG bytes.
+    """
+    height, width, _ = pixels.shape
+    # Every scanline starts with filter type 0 (none)
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = pixels.reshape(height, width * 3)
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)  # 8-bit RGB
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(raw.tobytes(), 6))
+        + _png_chunk(b"IEND", b"")
+    )
+
+def render_sparkline(times, players, start_ts, end_ts, max_players,
+                     width=SPARKLINE_WIDTH, height=SPARKLINE_HEIGHT, max_gap=180):
+    """
+    Rasterize a player history into a small PNG with NumPy only: filled area under
+    a line, with a faint grid line every 10 players. Returns the PNG bytes.
+    """
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[:] = SPARKLINE_BACKGROUND
+
+    scale = (height - 1) / max(1, max_players)
+    grid_rows = height - 1 - np.round(np.arange(10, max_players, 10) * scale).astype(np.int64)
+    pixels[grid_rows[(grid_rows >= 0) & (grid_rows < height)]] = SPARKLINE_GRID
+
+    # One sample per pixel column, columns inside a gap stay empty
+    columns = start_ts + (np.arange(width) + 0.5) * (end_ts - start_ts) / width
+    values = align_series(np.asarray(times, dtype=np.float64), players, columns, max_gap)
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return encode_png(pixels)
+    values = np.where(valid, values, 0)
+
+    y = height - 1 - np.clip(np.round(values * scale), 0, height - 1).astype(np.int64)
+    rows = np.arange(height)[:, None]
+
+    # Area under the line
+    fill = (rows >= y[None, :]) & valid[None, :]
+    pixels[fill] = SPARKLINE_FILL
+
+    # The line itself: each column covers the rows between its value and the previous one,
+    # so steep changes stay connected
+    previous = np.concatenate([y[:1], y[:-1]])
+    previous = np.where(np.concatenate([[False], valid[:-1]]), previous, y)
+    low = np.minimum(y, previous)
+    high = np.maximum(y, previous)
+    stroke = (rows >= low[None, :] - 1) & (rows <= high[None, :]) & valid[None, :]
+    pixels[stroke] = SPARKLINE_LINE
+
+    return encode_png(pixels)
+
+history_renderer = HistoryGraphRenderer()
@@ -0,0 +1,158 @@
+# Append-only on-disk archive of ark_servers_history, read with numpy.memmap
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+import aiomysql
+import numpy as np
+
+from tools.connector import db_connector
+
+ARCHIVE_DIR = "history_archive"
+META_FILE = "meta.json"
+
+# One fixed-width record per history row: 10 bytes, sorted by time within a server file
+RECORD_DTYPE = np.dtype([("time", "<i8"), ("players", "<i2")])
+
+# Rows newer than this are left to the DB, they may still be arriving
+COMPACT_LAG_SECONDS = 3600
+FETCH_CHUNK_SIZE = 50000
+
+class HistoryArchive:
+    '''
+    One binary file per server under ARCHIVE_DIR holding its history rows as packed
+    (time, players) records, plus meta.json with the watermark: every row with
+    time <= watermark is in the archive.
+
+    Files are only ever appended to by compact(), so readers can memory-map them
+    and slice time ranges without copying. Readers notice a new compaction through
+    the mtime of meta.json.
+    '''
+
+    def __init__(self, directory=ARCHIVE_DIR):
+        self.directory = directory
+        self.watermark = 0
+        self._meta_mtime = None
+        self._maps = {}  # ark_server -> (file size, memmap)
+
+    def _path(self, server):
+        return os.path.join(self.directory, f"{server}.bin")
+
+    def refresh(self):
+        """
+        Re-read the watermark if another process compacted since we last looked.
+        """
+        meta_path = os.path.join(self.directory, META_FILE)
+        try:
+            mtime = os.stat(meta_path).st_mtime
+        except FileNotFoundError:
+            self.watermark = 0
+            return self.watermark
+        if mtime != self._meta_mtime:
+            with open(meta_path, "r") as f:
+                self.watermark = int(json.load(f).get("watermark", 0))
+            self._meta_mtime = mtime
+        return self.watermark
+
+    def _records(self, server):
+        path = self._path(str(server))
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+        if size < RECORD_DTYPE.itemsize:
+            return None
+        cached = self._maps.get(server)
+        if cached is None or cached[0] != size:
+            # Map only whole records, a compaction may be halfway through an append
+            count = size // RECORD_DTYPE.itemsize
+            cached = self._maps[server] = (size, np.memmap(path, dtype=RECORD_DTYPE, mode="r", shape=(count,)))
+        return cached[1]
+
+    def read(self, server_number, start_ts, end_ts):
+        """
+        Returns (times, players) for start_ts <= time < end_ts as views into the memmap.
+        """
+        records = self._records(str(server_number))
+        if records is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int16)
+        times = records["time"]
+        lo, hi = np.searchsorted(times, [start_ts, end_ts])
+        return times[lo:hi], records["players"][lo:hi]
+
+    def _last_time(self, server):
+        records = self._records(server)
+        return int(records["time"][-1]) if records is not None else 0
+
+    async def compact(self, upto=None):
+        """
+        Append DB rows between the watermark and upto to the per-server files.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        since = self.refresh()
+        upto = upto if upto is not None else int(time.time()) - COMPACT_LAG_SECONDS
+        if upto <= since:
+            return 0
+
+        appended = 0
+        pending = {}  # ark_server -> list of (time, players)
+
+        def write(server, rows):
+            nonlocal appended
+            # A crash between appending and saving the watermark must not duplicate rows
+            last = self._last_time(server)
+            records = np.array(rows, dtype=RECORD_DTYPE)
+            records = records[records["time"] > last]
+            if len(records):
+                with open(self._path(server), "ab") as f:
+                    f.write(records.tobytes())
+                appended += len(records)
+
+        conn = await db_connector()
+        try:
+            async with conn.cursor(aiomysql.SSCursor) as cursor:
+                await cursor.execute(
+                    """
+                    SELECT ark_server, time, players
+                    FROM ark_servers_history
+                    WHERE time > %s AND time <= %s
+                    ORDER BY ark_server, time
+                    """,
+                    (since, upto)
+                )
+                while True:
+                    chunk = await cursor.fetchmany(FETCH_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    for ark_server, ts, players in chunk:
+                        pending.setdefault(str(ark_server), []).append((int(ts), int(players)))
+                    # Rows come grouped by server, so everything but the last server is complete
+                    for server in [server for server in pending if server != str(chunk[-1][0])]:
+                        write(server, pending.pop(server))
+        finally:
+            conn.close()
+        for server, rows in pending.items():
+            write(server, rows)
+
+        # Write the new watermark atomically so readers never see a partial file
+        meta_path = os.path.join(self.directory, META_FILE)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"watermark": upto}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        self.refresh()
+        logging.info(f"[history_archive.py] Archived {appended} rows up to {upto}.")
+        return appended
+
+history_archive = HistoryArchive()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact ark_servers_history into the memory-mapped archive.")
+    parser.add_argument("--dir", default=ARCHIVE_DIR, help="Archive directory")
+    parser.add_argument("--lag", type=int, default=COMPACT_LAG_SECONDS, help="Leave rows newer than this many seconds in the DB only")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    asyncio.run(HistoryArchive(args.dir).compact(int(time.time()) - args.lag))
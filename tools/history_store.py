@@ -0,0 +1,204 @@
+# In-process columnar store of recent ark_servers_history rows
+import logging
+import time
+
+import numpy as np
+
+from tools.connector import db_connector
+
+# How far back the store answers queries
+RETENTION_SECONDS = 48 * 3600
+# Monitors write about every 30s and the server-list feed every 60s, a server written
+# by both gets ~5760 points in 48h. Buffers start at this size and double whenever the
+# oldest point they'd overwrite is still inside the retention window.
+RING_CAPACITY = 4096
+# A server whose last write is older than this isn't trusted anymore: something else
+# (another process, a restart) may have written rows the store never saw
+INGEST_STALE_SECONDS = 300
+
+def bucket_average(times, players, bucket_seconds):
+    """
+    Average (times, players) per bucket, the same as GROUP BY time DIV bucket with AVG().
+    """
+    if not bucket_seconds or len(times) == 0:
+        return times, players
+    buckets = times // bucket_seconds
+    keys, inverse = np.unique(buckets, return_inverse=True)
+    sums = np.bincount(inverse, weights=players)
+    counts = np.bincount(inverse)
+    return keys * bucket_seconds, (sums / counts).astype(np.float32)
+
+class ServerSeries:
+    '''
+    Ring buffer of (timestamp, players) for one server.
+    '''
+
+    __slots__ = ("times", "players", "head", "count", "covered_from", "last_ingest")
+
+    def __init__(self, capacity=RING_CAPACITY):
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.players = np.zeros(capacity, dtype=np.float32)
+        self.head = 0  # Next slot to write
+        self.count = 0
+        self.covered_from = None  # The buffer holds every point the DB has from this timestamp on
+        self.last_ingest = 0
+
+    def append(self, timestamp, players):
+        if self.count == len(self.times) and self.times[self.head] > timestamp - RETENTION_SECONDS:
+            # Full and the oldest point is still needed
+            self._resize(len(self.times) * 2)
+        self.times[self.head] = timestamp
+        self.players[self.head] = players
+        self.head = (self.head + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    def _resize(self, capacity):
+        times, players = self.ordered()
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.players = np.zeros(capacity, dtype=np.float32)
+        self.times[:len(times)] = times
+        self.players[:len(times)] = players
+        self.count = len(times)
+        self.head = len(times) % capacity
+
+    def ordered(self):
+        """
+        Returns (times, players) oldest first.
+        """
+        start = (self.head - self.count) % len(self.times)
+        index = (start + np.arange(self.count)) % len(self.times)
+        times, players = self.times[index], self.players[index]
+        if self.count > 1 and np.any(times[1:] < times[:-1]):
+            order = np.argsort(times, kind="stable")
+            times, players = times[order], players[order]
+        return times, players
+
+    def window(self, start_ts):
+        times, players = self.ordered()
+        first = np.searchsorted(times, start_ts)
+        return times[first:], players[first:]
+
+    def replace(self, times, players):
+        """
+        Reset the buffer to the given rows (oldest first), growing it if they don't fit.
+        """
+        capacity = len(self.times)
+        while capacity < len(times):
+            capacity *= 2
+        if capacity != len(self.times):
+            self.times = np.zeros(capacity, dtype=np.int64)
+            self.players = np.zeros(capacity, dtype=np.float32)
+        self.times[:len(times)] = times
+        self.players[:len(times)] = players
+        self.count = len(times)
+        self.head = len(times) % len(self.times)
+
+class HistoryStore:
+    '''
+    Keeps the last RETENTION_SECONDS of player counts per server in NumPy ring buffers,
+    fed by the same code paths that insert into ark_servers_history.
+
+    A server is only answered from memory while this process keeps writing its history
+    (last ingest within INGEST_STALE_SECONDS) and the buffer covers the query without
+    gaps, either because it was warmed from the DB or because this process has been
+    writing the server since before the start of the query. The first query for such a server loads the retention window from the
+    DB once; after that, graph queries for it need no DB round-trip. Everything else
+    (other servers, older ranges) still goes to MySQL.
+    '''
+
+    def __init__(self):
+        self.series = {}  # ark_server -> ServerSeries
+
+    def ingest(self, server_number, players, timestamp):
+        server = str(server_number)
+        series = self.series.get(server)
+        if series is None:
+            series = self.series[server] = ServerSeries()
+            series.covered_from = timestamp
+        elif series.last_ingest and timestamp - series.last_ingest > INGEST_STALE_SECONDS:
+            # We were not writing for a while, the DB may have rows we never saw
+            series.covered_from = timestamp
+        series.append(timestamp, players)
+        series.last_ingest = max(series.last_ingest, timestamp)
+
+    def _servable(self, server, start_ts, now):
+        series = self.series.get(server)
+        return (
+            series is not None
+            and series.count > 0
+            and now - series.last_ingest <= INGEST_STALE_SECONDS
+            and start_ts >= now - RETENTION_SECONDS
+        )
+
+    def _complete(self, server, start_ts):
+        """
+        True if the buffer holds every point of this server since start_ts.
+        """
+        covered_from = self.series[server].covered_from
+        return covered_from is not None and covered_from <= start_ts
+
+    async def _warm(self, servers, now):
+        """
+        Load the retention window of several servers from the DB in one query.
+        Points ingested while the query ran are kept on top of the DB rows.
+        """
+        since = now - RETENTION_SECONDS
+        placeholders = ", ".join(["%s"] * len(servers))
+        conn = await db_connector()
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"""
+                    SELECT ark_server, time, players
+                    FROM ark_servers_history
+                    WHERE ark_server IN ({placeholders}) AND time >= %s
+                    ORDER BY ark_server, time
+                    """,
+                    (*servers, since)
+                )
+                rows = await cursor.fetchall()
+        finally:
+            conn.close()
+
+        by_server = {server: ([], []) for server in servers}
+        for ark_server, ts, players in rows:
+            times, counts = by_server.setdefault(str(ark_server), ([], []))
+            times.append(int(ts))
+            counts.append(float(players))
+
+        for server, (times, counts) in by_server.items():
+            series = self.series.get(server)
+            if series is None:
+                continue
+            times = np.array(times, dtype=np.int64)
+            counts = np.array(counts, dtype=np.float32)
+            newest = times[-1] if len(times) else since - 1
+            mem_times, mem_players = series.ordered()
+            newer = mem_times > newest
+            series.replace(np.concatenate([times, mem_times[newer]]), np.concatenate([counts, mem_players[newer]]))
+            series.covered_from = since
+        logging.info(f"[history_store.py] Warmed {len(servers)} servers with {len(rows)} rows.")
+
+    async def query(self, server_numbers, start_ts, bucket_seconds=0):
+        """
+        Answer what can be answered from memory.
+        Returns {server_number: (times, players)} for the servers that were served; the rest must go to the DB.
+        """
+        now = int(time.time())
+        servable = [str(server) for server in server_numbers if self._servable(str(server), start_ts, now)]
+        cold = [server for server in servable if not self._complete(server, start_ts)]
+        if cold:
+            try:
+                await self._warm(cold, now)
+            except Exception as e:
+                logging.warning(f"[history_store.py] Could not warm {cold}: {e}")
+            # Whatever still doesn't reach back to start_ts is answered by MySQL
+            servable = [server for server in servable if self._complete(server, start_ts)]
+
+        result = {}
+        for server in servable:
+            times, players = self.series[server].window(start_ts)
+            result[server] = bucket_average(times, players, bucket_seconds)
+        return result
+
+history_store = HistoryStore()
@@ -0,0 +1,111 @@
+# Local IPC between the collector and the bot: JSON lines over a Unix socket
+import asyncio
+import json
+import logging
+import os
+
+# Set in the bot's environment to take data from a running collector instead of collecting itself
+COLLECTOR_SOCKET = os.getenv("COLLECTOR_SOCKET")
+DEFAULT_SOCKET_PATH = "/tmp/ark_collector.sock"
+
+# A full server list is one message, so lines can get big
+LINE_LIMIT = 64 * 1024 * 1024
+# A subscriber that can't take a message within this long is dropped
+SEND_TIMEOUT_SECONDS = 5
+RECONNECT_SECONDS = 5
+
+class Publisher:
+    '''
+    Unix socket server that sends every published message, as one JSON line of
+    {"topic": ..., "payload": ...}, to every connected subscriber.
+    '''
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        self.path = path
+        self.writers = set()
+        self.server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            try:
+                _, writer = await asyncio.open_unix_connection(self.path)
+            except OSError:
+                os.remove(self.path)  # Left over from a previous run
+            else:
+                writer.close()
+                raise RuntimeError(f"Another collector is already publishing on {self.path}")
+        self.server = await asyncio.start_unix_server(self._on_connect, path=self.path)
+        logging.info(f"[ipc.py] Publishing on {self.path}")
+
+    async def _on_connect(self, reader, writer):
+        self.writers.add(writer)
+        logging.info(f"[ipc.py] Subscriber connected ({len(self.writers)} total).")
+        try:
+            # Subscribers don't send anything, this just notices when they go away
+            await reader.read()
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def publish(self, topic, payload):
+        if not self.writers:
+            return
+        line = (json.dumps({"topic": topic, "payload": payload}, separators=(",", ":")) + "\n").encode()
+        for writer in list(self.writers):
+            try:
+                writer.write(line)
+                await asyncio.wait_for(writer.drain(), timeout=SEND_TIMEOUT_SECONDS)
+            except Exception as e:
+                logging.warning(f"[ipc.py] Dropping subscriber: {e}")
+                self.writers.discard(writer)
+                writer.close()
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        for writer in list(self.writers):
+            writer.close()
+        self.writers.clear()
+
+class Subscriber:
+    '''
+    Connects to a Publisher and calls handlers[topic](payload) for every message,
+    reconnecting whenever the collector goes away.
+    '''
+
+    def __init__(self, path, handlers):
+        self.path = path
+        self.handlers = handlers
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=LINE_LIMIT)
+                logging.info(f"[ipc.py] Subscribed to collector at {self.path}")
+                try:
+                    while True:
+                        line = await reader.readline()
+                        if not line:
+                            break
+                        message = json.loads(line)
+                        handler = self.handlers.get(message.get("topic"))
+                        if handler is None:
+                            continue
+                        try:
+                            await handler(message.get("payload"))
+                        except Exception as e:
+                            logging.error(f"[ipc.py] Handler for {message.get('topic')} failed: {e}")
+                finally:
+                    writer.close()
+                logging.warning("[ipc.py] Collector closed the connection.")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"[ipc.py] Could not read from collector at {self.path}: {e}")
+            await asyncio.sleep(RECONNECT_SECONDS)
@@ -1,13 +1,15 @@
 # Build Discord embeds to display player information with ANSI color codes
 import discord
 from datetime import datetime, timezone
-from tools.database_tools import get_user_alias, get_user_tribe_and_most_joined_server
+from tools.database_tools import get_user_alias, get_user_tribe_and_most_joined_server, get_player_groups
 
 async def build_player_list_embeds(server_number, puids_info, custom_server_name, total_players, max_players, conn):
     # Fetch user aliases and tribes efficiently
     puid_list = [player['puid'] for player in puids_info]
     puid_to_alias = {}
     puid_to_tribe = {}
+    # Inferred groups from the clustering job, one query for the whole list
+    puid_to_group = await get_player_groups(puid_list, conn)
 
     if puid_list:
         for puid in puid_list:
@@ -34,9 +36,11 @@ async def build_player_list_embeds(server_number, puids_info, custom_server_name
         elif tribe.isdigit():
             main_server = tribe
 
+        group = puid_to_group.get(player['puid'], "-")
+
         # Adjust spacing for a tighter layout between name, tribe, and server number
-        # Example: [01] | DisplayName        (Alias)        | Tribe (Server) | LastLogin
-        line_content = f"{player['display_name']:<19} ({alias:<8}) | {tribe:<14} | {player['last_login']}"
+        # Example: [01] | DisplayName        (Alias)        | Tribe (Server) | Group | LastLogin
+        line_content = f"{player['display_name']:<19} ({alias:<8}) | {tribe:<14} | {group:<12} | {player['last_login']}"
         if str(main_server) == str(server_number):
             line = f"\u001b[1;32m{line_content}\u001b[0m"
         else:
@@ -0,0 +1,137 @@
+# Playtime aggregates per player, updated incrementally as sessions close
+import logging
+from collections import defaultdict
+
+import aiomysql
+
+PLAYER_STATS_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS player_server_stats (
+        puid VARCHAR(32) NOT NULL,
+        server VARCHAR(16) NOT NULL,
+        seconds_played BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        sessions INT UNSIGNED NOT NULL DEFAULT 0,
+        last_seen INT UNSIGNED NOT NULL DEFAULT 0,
+        PRIMARY KEY (puid, server)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS player_hour_stats (
+        puid VARCHAR(32) NOT NULL,
+        hour TINYINT UNSIGNED NOT NULL,
+        seconds BIGINT UNSIGNED NOT NULL DEFAULT 0,
+        PRIMARY KEY (puid, hour)
+    )
+    """,
+]
+
+async def ensure_player_stats_schema(conn):
+    async with conn.cursor() as cursor:
+        for statement in PLAYER_STATS_SCHEMA:
+            await cursor.execute(statement)
+    await conn.commit()
+
+def split_by_hour(start, end):
+    """
+    Returns {utc_hour: seconds} for the time between two unix timestamps.
+    """
+    hours = defaultdict(int)
+    if end <= start:
+        return hours
+
+    # Whole days add the same amount to every hour
+    days, _ = divmod(end - start, 86400)
+    if days:
+        for hour in range(24):
+            hours[hour] += days * 3600
+        start += days * 86400
+
+    while start < end:
+        hour_end = (start // 3600 + 1) * 3600
+        chunk_end = min(hour_end, end)
+        hours[(start // 3600) % 24] += chunk_end - start
+        start = chunk_end
+    return hours
+
+async def update_player_stats(conn, closed_sessions):
+    """
+    Fold closed sessions into the aggregate tables.
+    closed_sessions: list of (puid, server, joined_at, left_at)
+    """
+    if not closed_sessions:
+        return
+
+    server_rows = defaultdict(lambda: [0, 0, 0])  # (puid, server) -> [seconds, sessions, last_seen]
+    hour_rows = defaultdict(int)  # (puid, hour) -> seconds
+    for puid, server, joined_at, left_at in closed_sessions:
+        joined_at, left_at = int(joined_at), int(left_at)
+        row = server_rows[(puid, str(server))]
+        row[0] += max(0, left_at - joined_at)
+        row[1] += 1
+        row[2] = max(row[2], left_at)
+        for hour, seconds in split_by_hour(joined_at, left_at).items():
+            hour_rows[(puid, hour)] += seconds
+
+    async with conn.cursor() as cursor:
+        await cursor.executemany(
+            """
+            INSERT INTO player_server_stats (puid, server, seconds_played, sessions, last_seen)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                seconds_played = seconds_played + VALUES(seconds_played),
+                sessions = sessions + VALUES(sessions),
+                last_seen = GREATEST(last_seen, VALUES(last_seen))
+            """,
+            [(puid, server, *row) for (puid, server), row in server_rows.items()]
+        )
+        await cursor.executemany(
+            """
+            INSERT INTO player_hour_stats (puid, hour, seconds)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE seconds = seconds + VALUES(seconds)
+            """,
+            [(puid, hour, seconds) for (puid, hour), seconds in hour_rows.items()]
+        )
+    await conn.commit()
+    logging.info(f"[player_stats.py] Aggregated {len(closed_sessions)} closed sessions.")
+
+async def get_player_stats(conn, puid):
+    """
+    Returns (per_server_rows, hour_seconds, open_session) for a player.
+    per_server_rows is sorted by time played, hour_seconds is a list of 24 ints (UTC)
+    and open_session is (server, joined_at) or None.
+    """
+    async with conn.cursor(aiomysql.DictCursor) as cursor:
+        await cursor.execute(
+            """
+            SELECT server, seconds_played, sessions, last_seen
+            FROM player_server_stats
+            WHERE puid = %s
+            ORDER BY seconds_played DESC
+            """,
+            (puid,)
+        )
+        per_server = await cursor.fetchall()
+
+        await cursor.execute(
+            "SELECT hour, seconds FROM player_hour_stats WHERE puid = %s", (puid,)
+        )
+        hour_seconds = [0] * 24
+        for row in await cursor.fetchall():
+            hour_seconds[int(row['hour'])] = int(row['seconds'])
+
+        # The running session isn't in the aggregates until it closes
+        await cursor.execute(
+            """
+            SELECT server, joined_at
+            FROM player_sessions
+            WHERE puid = %s AND left_at IS NULL
+            ORDER BY joined_at DESC
+            LIMIT 1
+            """,
+            (puid,)
+        )
+        row = await cursor.fetchone()
+        open_session = (row['server'], int(row['joined_at'])) if row else None
+
+    return per_server, hour_seconds, open_session
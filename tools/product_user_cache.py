@@ -0,0 +1,63 @@
+# Stale-while-revalidate cache of EOS product-user records, keyed by puid
+import time
+from collections import OrderedDict
+
+# Records younger than this are served as-is
+PRODUCT_USER_FRESH_SECONDS = 5 * 60
+# Records between fresh and this age are served immediately and refreshed in the background,
+# older ones are treated as misses
+PRODUCT_USER_MAX_AGE_SECONDS = 6 * 3600
+# Upper bound on cached puids, least recently used are evicted first
+PRODUCT_USER_CACHE_SIZE = 50000
+
+class ProductUserCache:
+    '''
+    Holds the accounts returned by /user/v9/product-users/search for each puid.
+
+    Each record is a list of accounts:
+        {"account": ..., "platform": ..., "display_name": ..., "last_login_ts": int or None}
+    An empty list means EOS returned nothing for that puid, which is cached too.
+    '''
+
+    def __init__(self, max_size=PRODUCT_USER_CACHE_SIZE):
+        self.max_size = max_size
+        self.records = OrderedDict()  # puid -> (fetched_at, accounts)
+        self.refreshing = set()  # puids with a background refresh in flight
+
+    def classify(self, puids):
+        """
+        Split puids into (fresh, stale, missing) lists.
+        """
+        now = time.monotonic()
+        fresh, stale, missing = [], [], []
+        for puid in puids:
+            record = self.records.get(puid)
+            if record is None:
+                missing.append(puid)
+                continue
+            age = now - record[0]
+            if age < PRODUCT_USER_FRESH_SECONDS:
+                fresh.append(puid)
+            elif age < PRODUCT_USER_MAX_AGE_SECONDS:
+                stale.append(puid)
+            else:
+                missing.append(puid)
+        return fresh, stale, missing
+
+    def get(self, puid):
+        """
+        Returns the cached accounts for a puid, or None.
+        """
+        record = self.records.get(puid)
+        if record is None:
+            return None
+        self.records.move_to_end(puid)
+        return record[1]
+
+    def put(self, puid, accounts):
+        self.records[puid] = (time.monotonic(), accounts)
+        self.records.move_to_end(puid)
+        while len(self.records) > self.max_size:
+            self.records.popitem(last=False)
+
+product_user_cache = ProductUserCache()
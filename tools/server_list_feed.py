@@ -0,0 +1,201 @@
+# Background server-list refresher that diffs each download against the previous one
+import asyncio
+import logging
+import re
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from tools.EOS import EOS
+
+# One download of officialserverlist.json per interval, shared by everyone
+REFRESH_SECONDS = 60
+# A snapshot older than this many intervals is not trusted for lookups
+MAX_SNAPSHOT_AGE_INTERVALS = 3
+# NumPlayers changes at least this large between two refreshes are reported
+POPULATION_JUMP = 15
+# A list this much smaller than the previous one is a partial download, not servers going
+# away, so its "disappeared" events are dropped
+MAX_SHRINK_FRACTION = 0.1
+
+SERVER_NUMBER_PATTERN = re.compile(r"(\d+)\s*$")
+
+def server_number_of(name):
+    """
+    The server number at the end of a server name, e.g. "NA-PVP-TheIsland2154" -> "2154".
+    """
+    match = SERVER_NUMBER_PATTERN.search(name or "")
+    return match.group(1) if match else None
+
+class ServerEvent(NamedTuple):
+    '''One change between two server-list snapshots.'''
+    kind: str  # "restart", "appeared", "disappeared" or "population_jump"
+    name: str
+    server_number: str
+    cluster: str
+    old_players: int
+    new_players: int
+    timestamp: int
+
+class ServerListSnapshot:
+    '''
+    One server-list download with its interesting fields pulled out into NumPy columns.
+    '''
+
+    def __init__(self, servers, timestamp):
+        self.servers = servers
+        self.timestamp = timestamp
+        self.names = np.array([str(server.get("Name", "")) for server in servers], dtype=str)
+        self.sessions = np.array([str(server.get("SessionID", "")) for server in servers], dtype=str)
+        self.clusters = np.array([str(server.get("ClusterId", "")) for server in servers], dtype=str)
+        self.players = np.array([int(server.get("NumPlayers") or 0) for server in servers], dtype=np.int32)
+
+        # PVPCrossplay servers by number, for matchmaking lookups
+        self.by_number = {}
+        for server in servers:
+            if server.get("ClusterId") == "PVPCrossplay":
+                number = server_number_of(server.get("Name"))
+                if number is not None:
+                    self.by_number.setdefault(number, server)
+
+    def find(self, server_number):
+        """
+        The PVPCrossplay entry for a server number, matching the name like matchmaking always has.
+        """
+        server_number = str(server_number)
+        server = self.by_number.get(server_number)
+        if server is not None:
+            return server
+        return next(
+            (
+                item
+                for item in self.servers
+                if server_number in item.get("Name", "") and item.get("ClusterId") == "PVPCrossplay"
+            ),
+            None
+        )
+
+    def _event(self, kind, index, old_players, new_players):
+        name = str(self.names[index])
+        return ServerEvent(kind, name, server_number_of(name), str(self.clusters[index]),
+                           int(old_players), int(new_players), self.timestamp)
+
+def diff_snapshots(previous, current, population_jump=POPULATION_JUMP, max_shrink=MAX_SHRINK_FRACTION):
+    """
+    Compare two snapshots by server name. Returns a list of ServerEvent.
+    """
+    events = []
+    common, prev_index, curr_index = np.intersect1d(previous.names, current.names, return_indices=True)
+
+    # A new SessionID for the same server name means it restarted
+    restarted = previous.sessions[prev_index] != current.sessions[curr_index]
+    for i in np.flatnonzero(restarted):
+        events.append(current._event("restart", curr_index[i],
+                                     previous.players[prev_index[i]], current.players[curr_index[i]]))
+
+    delta = current.players[curr_index] - previous.players[prev_index]
+    jumped = (np.abs(delta) >= population_jump) & ~restarted
+    for i in np.flatnonzero(jumped):
+        events.append(current._event("population_jump", curr_index[i],
+                                     previous.players[prev_index[i]], current.players[curr_index[i]]))
+
+    # The full list coming back after a partial one isn't all those servers appearing either
+    if len(previous.names) >= (1 - max_shrink) * len(current.names):
+        for i in np.flatnonzero(~np.isin(current.names, previous.names)):
+            events.append(current._event("appeared", i, 0, current.players[i]))
+    if len(current.names) < (1 - max_shrink) * len(previous.names):
+        logging.warning(f"[server_list_feed.py] Server list shrank from {len(previous.names)} to "
+                        f"{len(current.names)} servers, not reporting disappeared servers.")
+        return events
+    for i in np.flatnonzero(~np.isin(previous.names, current.names)):
+        event = previous._event("disappeared", i, previous.players[i], 0)
+        events.append(event._replace(timestamp=current.timestamp))
+    return events
+
+class ServerListFeed:
+    '''
+    Downloads the official server list every REFRESH_SECONDS, diffs it against the
+    previous download and hands (snapshot, events) to every subscriber.
+
+    Subscribers are async callables taking (snapshot, events); they are called after
+    every refresh, also when there are no events, so they can keep derived views current.
+    '''
+
+    def __init__(self, interval=REFRESH_SECONDS):
+        self.interval = interval
+        self.snapshot = None
+        self.subscribers = []
+        self.task = None
+
+    def subscribe(self, callback):
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+    def fresh_snapshot(self):
+        """
+        The latest snapshot, or None if the feed isn't running or has fallen behind.
+        """
+        snapshot = self.snapshot
+        if snapshot is None or time.time() - snapshot.timestamp > self.interval * MAX_SNAPSHOT_AGE_INTERVALS:
+            return None
+        return snapshot
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+            logging.info(f"[server_list_feed.py] Started, refreshing every {self.interval}s.")
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def refresh(self):
+        # No cached list here: it would be recorded and diffed as if it were downloaded now
+        servers = await EOS().fresh_server_list()
+        return await self.apply(servers, int(time.time()))
+
+    async def apply(self, servers, timestamp):
+        """
+        Take a downloaded server list as the new snapshot: diff it and notify subscribers.
+        Used directly when the list comes from the collector instead of our own download.
+        """
+        snapshot = ServerListSnapshot(servers, timestamp)
+        events = diff_snapshots(self.snapshot, snapshot) if self.snapshot is not None else []
+        self.snapshot = snapshot
+        if events:
+            counts = {}
+            for event in events:
+                counts[event.kind] = counts.get(event.kind, 0) + 1
+            logging.info(f"[server_list_feed.py] {len(snapshot.servers)} servers, events: {counts}")
+        await self._publish(snapshot, events)
+        return events
+
+    async def _publish(self, snapshot, events):
+        for callback in list(self.subscribers):
+            try:
+                await callback(snapshot, events)
+            except Exception as e:
+                logging.error(f"[server_list_feed.py] Subscriber {getattr(callback, '__qualname__', callback)} failed: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"[server_list_feed.py] Refresh failed: {e}")
+            await asyncio.sleep(self.interval)
+
+server_list_feed = ServerListFeed()
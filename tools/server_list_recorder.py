@@ -0,0 +1,75 @@
+# Record every PVPCrossplay server's population from each server-list refresh
+import logging
+import time
+
+from tools.connector import db_connector
+from tools.history_store import history_store
+from tools.server_registry import server_registry
+
+# Rows per executemany
+INSERT_CHUNK_SIZE = 2000
+# A server recorded within this many seconds doesn't need its monitor to write history too
+COVERAGE_SECONDS = 150
+
+class ServerListRecorder:
+    '''
+    Feed subscriber that writes NumPlayers of every PVPCrossplay server in a snapshot
+    to ark_servers_history in one bulk insert, so the whole cluster gets history for
+    the cost of the one download the feed already makes.
+
+    Only monitored servers and those in ark_servers_new are also kept in the in-memory
+    history store; the rest is only ever graphed from MySQL.
+    '''
+
+    def __init__(self):
+        self.last_recorded = {}  # ark_server -> timestamp of the last row we wrote
+        self.tracked = set()  # ark_server of every running monitor, kept by Monitor_Manager
+        # Off in the bot when a collector process does the writing; coverage is still tracked
+        self.write = True
+        self.recorded_at = None  # Timestamp of the last snapshot this process wrote
+        # Set by the bot per snapshot: whether the collector managed to write it
+        self.remote_recorded = False
+
+    def covers(self, server_number):
+        """
+        True if the recorder wrote this server's population recently, so a monitor can skip its own row.
+        """
+        last = self.last_recorded.get(str(server_number))
+        return last is not None and time.time() - last <= COVERAGE_SECONDS
+
+    async def record(self, snapshot, events):
+        rows = [
+            (number, int(server.get("NumPlayers") or 0), snapshot.timestamp)
+            for number, server in snapshot.by_number.items()
+        ]
+        if not rows:
+            return
+
+        if self.write:
+            conn = await db_connector()
+            try:
+                async with conn.cursor() as cursor:
+                    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+                        await cursor.executemany(
+                            """
+                            INSERT INTO ark_servers_history (ark_server, players, time)
+                            VALUES (%s, %s, %s)
+                            """,
+                            rows[i:i + INSERT_CHUNK_SIZE]
+                        )
+                await conn.commit()
+            finally:
+                conn.close()
+            self.recorded_at = snapshot.timestamp
+        elif not self.remote_recorded:
+            # The collector couldn't write this one, so monitors keep writing their own rows
+            return
+
+        for number, players, timestamp in rows:
+            if number in self.tracked or number in server_registry.servers:
+                history_store.ingest(number, players, timestamp)
+            self.last_recorded[number] = timestamp
+        if self.write:
+            logging.info(f"[server_list_recorder.py] Recorded population of {len(rows)} servers.")
+
+server_list_recorder = ServerListRecorder()
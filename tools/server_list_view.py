@@ -0,0 +1,97 @@
+# Indexed table of the server list for /list, rebuilt once per server-list refresh
+import numpy as np
+
+from tools.server_list_feed import server_list_feed
+
+SORT_KEYS = ("players", "players_asc", "ping", "name")
+MODES = ("pvp", "pve", "all")
+
+class ServerTable:
+    '''
+    The server list as NumPy columns plus one precomputed ordering per sort key.
+    A query is a handful of boolean masks over the columns followed by picking the
+    matching rows out of the requested ordering, so no per-command scan or sort.
+    '''
+
+    def __init__(self, servers):
+        self.servers = servers
+        self.names = np.array([str(server.get("Name", "")).lower() for server in servers], dtype=str)
+        # Maps and clusters only take a few distinct values, so they are kept as codes into those
+        self.map_values, self.maps = np.unique(
+            np.array([str(server.get("MapName", "")).lower() for server in servers], dtype=str), return_inverse=True
+        )
+        self.cluster_values, self.clusters = np.unique(
+            np.array([str(server.get("ClusterId", "")).lower() for server in servers], dtype=str), return_inverse=True
+        )
+        self.pve = np.array([bool(server.get("SessionIsPve", 0)) for server in servers], dtype=bool)
+        self.players = np.array([int(server.get("NumPlayers") or 0) for server in servers], dtype=np.int32)
+        self.pings = np.array([_int_or(server.get("ServerPing"), np.iinfo(np.int32).max) for server in servers], dtype=np.int32)
+
+        # Stable sorts, ties keep the server list's order
+        self.orders = {
+            "players": np.argsort(-self.players, kind="stable"),
+            "players_asc": np.argsort(self.players, kind="stable"),
+            "ping": np.argsort(self.pings, kind="stable"),
+            "name": np.argsort(self.names, kind="stable"),
+        }
+
+    def query(self, cluster="pvpcrossplay", mode="pvp", map_name=None, name=None,
+              min_players=None, max_players=None, max_ping=None, sort="players"):
+        """
+        Servers matching every given filter, in the order of sort.
+        Text filters are case-insensitive; map_name and name match substrings.
+        """
+        mask = np.ones(len(self.servers), dtype=bool)
+        if cluster:
+            mask &= self.clusters == _code(self.cluster_values, cluster.lower())
+        if mode == "pvp":
+            mask &= ~self.pve
+        elif mode == "pve":
+            mask &= self.pve
+        if map_name:
+            matching_maps = np.flatnonzero(np.char.find(self.map_values, map_name.lower()) >= 0)
+            mask &= np.isin(self.maps, matching_maps)
+        if name:
+            mask &= np.char.find(self.names, name.lower()) >= 0
+        if min_players is not None:
+            mask &= self.players >= min_players
+        if max_players is not None:
+            mask &= self.players <= max_players
+        if max_ping is not None:
+            mask &= self.pings <= max_ping
+
+        order = self.orders[sort]
+        return [self.servers[i] for i in order[mask[order]]]
+
+def _code(values, value):
+    """
+    Index of value in the sorted unique values, or -1 if it isn't there.
+    """
+    index = np.searchsorted(values, value)
+    return index if index < len(values) and values[index] == value else -1
+
+def _int_or(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+_tables = {}  # id of the server list -> (server list, table), only the latest is kept
+
+def server_table(servers):
+    """
+    The table for a downloaded server list, built once per list.
+    """
+    cached = _tables.get(id(servers))
+    if cached is not None and cached[0] is servers:
+        return cached[1]
+    table = ServerTable(servers)
+    _tables.clear()
+    _tables[id(servers)] = (servers, table)
+    return table
+
+async def _rebuild(snapshot, events):
+    # Build the table as soon as a refresh lands, so no command has to
+    server_table(snapshot.servers)
+
+server_list_feed.subscribe(_rebuild)
@@ -0,0 +1,113 @@
+# In-memory registry of ark_servers_new (room id and tribe per server)
+import asyncio
+import logging
+import time
+
+import aiomysql
+from tools.connector import db_connector
+
+# How long a lookup for a server that is not in ark_servers_new is remembered
+MISSING_SERVER_TTL = 300
+
+class ServerRegistry:
+    '''
+    Keeps every row of ark_servers_new in memory so room and tribe lookups on the
+    hot paths (monitors, /players, player embeds) never hit the database.
+
+    Writes made by the bot go through update() so the registry stays in sync.
+    Servers added behind the bot's back are picked up on a miss or on the next load().
+    '''
+
+    def __init__(self):
+        self.servers = {}  # ark_server -> {"room_id": int, "tribe": str or None}
+        self.loaded = False
+        self._missing = {}  # ark_server -> monotonic time of the last failed lookup
+        self._lock = asyncio.Lock()
+
+    async def load(self, conn=None):
+        """
+        (Re)load the whole table. Returns the rows as a list of dicts.
+        """
+        close_conn = False
+        if conn is None:
+            conn = await db_connector()
+            close_conn = True
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute("SELECT ark_server, room_id, tribe FROM ark_servers_new")
+                rows = await cursor.fetchall()
+        finally:
+            if close_conn:
+                conn.close()
+
+        self.servers = {
+            str(row['ark_server']): {"room_id": int(row['room_id'] or 0), "tribe": row['tribe']}
+            for row in rows
+        }
+        self._missing.clear()
+        self.loaded = True
+        logging.info(f"[server_registry.py] Loaded {len(self.servers)} servers from ark_servers_new.")
+        return rows
+
+    async def get(self, server_number):
+        """
+        Returns the registry entry for a server, or None if it is not in ark_servers_new.
+        """
+        if not self.loaded:
+            async with self._lock:
+                if not self.loaded:
+                    await self.load()
+
+        server_number = str(server_number)
+        entry = self.servers.get(server_number)
+        if entry is not None:
+            return entry
+
+        # Unknown server: check the database once in a while in case it was added elsewhere
+        missed_at = self._missing.get(server_number)
+        if missed_at is not None and time.monotonic() - missed_at < MISSING_SERVER_TTL:
+            return None
+
+        conn = await db_connector()
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(
+                    "SELECT room_id, tribe FROM ark_servers_new WHERE ark_server = %s", (server_number,)
+                )
+                row = await cursor.fetchone()
+        finally:
+            conn.close()
+
+        if not row:
+            self._missing[server_number] = time.monotonic()
+            return None
+        return self.update(server_number, room_id=row['room_id'], tribe=row['tribe'])
+
+    async def room_id(self, server_number):
+        """
+        Returns the room id of a server, or 0 if it is unknown.
+        """
+        entry = await self.get(server_number)
+        return entry["room_id"] if entry else 0
+
+    async def tribe(self, server_number):
+        """
+        Returns the tribe set for a server, or None.
+        """
+        entry = await self.get(server_number)
+        return entry["tribe"] if entry else None
+
+    def update(self, server_number, room_id=None, tribe=None):
+        """
+        Write-through hook, call after changing a row of ark_servers_new.
+        """
+        server_number = str(server_number)
+        entry = self.servers.setdefault(server_number, {"room_id": 0, "tribe": None})
+        if room_id is not None:
+            entry["room_id"] = int(room_id)
+        if tribe is not None:
+            entry["tribe"] = tribe
+        self._missing.pop(server_number, None)
+        return entry
+
+server_registry = ServerRegistry()
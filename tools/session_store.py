@@ -0,0 +1,105 @@
+# Player sessions (join -> leave per server) maintained from roster diffs
+import logging
+
+SESSION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS player_sessions (
+        id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        puid VARCHAR(32) NOT NULL,
+        server VARCHAR(16) NOT NULL,
+        joined_at INT UNSIGNED NOT NULL,
+        left_at INT UNSIGNED NULL,
+        KEY idx_puid_joined (puid, joined_at),
+        KEY idx_server_joined (server, joined_at),
+        KEY idx_server_open (server, left_at)
+    )
+"""
+
+# Session ids per UPDATE when closing orphaned sessions
+CLOSE_CHUNK_SIZE = 5000
+
+async def ensure_session_schema(conn):
+    async with conn.cursor() as cursor:
+        await cursor.execute(SESSION_SCHEMA)
+    await conn.commit()
+
+async def close_orphaned_sessions(conn, known_servers, timestamp):
+    """
+    Close open sessions on servers we have no previous roster for (e.g. the state
+    file was lost), since we can't tell whether those players are still online.
+    Returns the closed sessions as a list of (puid, server, joined_at, left_at).
+    """
+    if known_servers:
+        placeholders = ", ".join(["%s"] * len(known_servers))
+        condition = f"left_at IS NULL AND server NOT IN ({placeholders})"
+        params = list(known_servers)
+    else:
+        condition = "left_at IS NULL"
+        params = []
+
+    async with conn.cursor() as cursor:
+        # Read them first so their playtime still reaches the aggregates
+        await cursor.execute(f"SELECT id, puid, server, joined_at FROM player_sessions WHERE {condition}", params)
+        rows = await cursor.fetchall()
+        ids = [row[0] for row in rows]
+        for i in range(0, len(ids), CLOSE_CHUNK_SIZE):
+            chunk = ids[i:i + CLOSE_CHUNK_SIZE]
+            id_placeholders = ", ".join(["%s"] * len(chunk))
+            await cursor.execute(
+                f"UPDATE player_sessions SET left_at = %s WHERE id IN ({id_placeholders}) AND left_at IS NULL",
+                [timestamp, *chunk]
+            )
+    await conn.commit()
+    if rows:
+        logging.info(f"[session_store.py] Closed {len(rows)} orphaned sessions.")
+    return [(puid, server, joined_at, timestamp) for _, puid, server, joined_at in rows]
+
+async def record_roster_diffs(conn, diffs, timestamp):
+    """
+    Apply a batch of roster diffs in bulk.
+
+    diffs: list of (ark_server, joined_puids, left_puids)
+    Returns the sessions that were closed as a list of (puid, server, joined_at, left_at).
+    """
+    joined_rows = []
+    left_keys = []
+    for ark_server, joined, left in diffs:
+        server = str(ark_server)
+        joined_rows.extend((puid, server, timestamp) for puid in joined)
+        left_keys.extend((server, puid) for puid in left)
+
+    closed = []
+    async with conn.cursor() as cursor:
+        if left_keys:
+            # Read the open sessions first so callers can aggregate their durations
+            placeholders = ", ".join(["(%s, %s)"] * len(left_keys))
+            params = [value for key in left_keys for value in key]
+            await cursor.execute(
+                f"""
+                SELECT puid, server, joined_at
+                FROM player_sessions
+                WHERE left_at IS NULL AND (server, puid) IN ({placeholders})
+                """,
+                params
+            )
+            closed = [(puid, server, joined_at, timestamp) for puid, server, joined_at in await cursor.fetchall()]
+
+            await cursor.execute(
+                f"""
+                UPDATE player_sessions SET left_at = %s
+                WHERE left_at IS NULL AND (server, puid) IN ({placeholders})
+                """,
+                [timestamp, *params]
+            )
+
+        if joined_rows:
+            await cursor.executemany(
+                """
+                INSERT INTO player_sessions (puid, server, joined_at)
+                VALUES (%s, %s, %s)
+                """,
+                joined_rows
+            )
+    await conn.commit()
+
+    logging.info(f"[session_store.py] Sessions opened: {len(joined_rows)}, closed: {len(closed)}.")
+    return closed
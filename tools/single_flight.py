@@ -0,0 +1,28 @@
+# Coalesce identical concurrent calls into a single in-flight request
+import asyncio
+
+class SingleFlight:
+    '''
+    While a call for a key is running, further calls with the same key wait for
+    and share its result instead of starting their own. Nothing is kept once the
+    call finishes, so this never serves stale data.
+    '''
+
+    def __init__(self):
+        self.calls = {}  # key -> running task
+
+    async def do(self, key, func, *args, **kwargs):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.calls[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        # Shield so one caller being cancelled doesn't cancel the call for everyone else
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
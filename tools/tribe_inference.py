@@ -0,0 +1,266 @@
+# Infer player groups (likely tribes) by clustering who joins which servers
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import aiomysql
+import numpy as np
+
+from tools.connector import db_connector
+
+STATE_FILE = "tribe_inference_state.npz"
+
+GROUPS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS player_groups (
+        puid VARCHAR(32) NOT NULL PRIMARY KEY,
+        group_label VARCHAR(32) NOT NULL,
+        similarity FLOAT NOT NULL,
+        updated_at INT UNSIGNED NOT NULL
+    )
+"""
+
+# Players with fewer joins than this are not labelled
+MIN_JOINS = 3
+# Rows fetched per round-trip from the server-side cursor, and rows per bulk write
+FETCH_CHUNK_SIZE = 20000
+WRITE_CHUNK_SIZE = 5000
+# Rows of the matrix scored at once, bounds memory to roughly chunk nnz x clusters floats
+SCORE_CHUNK_ROWS = 50000
+
+class JoinMatrix:
+    '''
+    Sparse player x server matrix of join counts, kept as sorted COO triplets.
+    Persisted to STATE_FILE together with the user_servers watermark so each run
+    only reads rows added since the previous one.
+    '''
+
+    def __init__(self):
+        self.puids = []
+        self.servers = []
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.cols = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.float32)
+        self.watermark = 0
+
+    @classmethod
+    def load(cls, path=STATE_FILE):
+        matrix = cls()
+        if os.path.exists(path):
+            with np.load(path, allow_pickle=False) as data:
+                matrix.puids = data["puids"].astype(str).tolist()
+                matrix.servers = data["servers"].astype(str).tolist()
+                matrix.rows = data["rows"]
+                matrix.cols = data["cols"]
+                matrix.counts = data["counts"]
+                matrix.watermark = int(data["watermark"])
+        return matrix
+
+    def save(self, path=STATE_FILE):
+        np.savez_compressed(
+            path,
+            puids=np.array(self.puids, dtype="U32"),
+            servers=np.array(self.servers, dtype="U16"),
+            rows=self.rows,
+            cols=self.cols,
+            counts=self.counts,
+            watermark=np.int64(self.watermark),
+        )
+
+    def add(self, puids, servers, counts):
+        """
+        Merge a batch of (puid, server, count) into the matrix.
+        """
+        puid_index = {puid: i for i, puid in enumerate(self.puids)}
+        server_index = {server: i for i, server in enumerate(self.servers)}
+        new_rows = np.empty(len(puids), dtype=np.int64)
+        new_cols = np.empty(len(puids), dtype=np.int64)
+        for i, (puid, server) in enumerate(zip(puids, servers)):
+            row = puid_index.get(puid)
+            if row is None:
+                row = puid_index[puid] = len(self.puids)
+                self.puids.append(puid)
+            col = server_index.get(server)
+            if col is None:
+                col = server_index[server] = len(self.servers)
+                self.servers.append(server)
+            new_rows[i] = row
+            new_cols[i] = col
+
+        # Sum duplicate (row, col) cells and keep the triplets sorted by row
+        rows = np.concatenate([self.rows, new_rows])
+        cols = np.concatenate([self.cols, new_cols])
+        counts = np.concatenate([self.counts, np.asarray(counts, dtype=np.float32)])
+        cells, inverse = np.unique(rows * len(self.servers) + cols, return_inverse=True)
+        self.counts = np.bincount(inverse, weights=counts).astype(np.float32)
+        self.rows, self.cols = np.divmod(cells, len(self.servers))
+
+async def read_new_joins(conn, matrix):
+    """
+    Stream join counts added to user_servers since the watermark into the matrix.
+    """
+    # Stop at the start of the current second so rows landing mid-run aren't skipped next time
+    upper = int(time.time()) - 1
+    puids, servers, counts = [], [], []
+    async with conn.cursor(aiomysql.SSCursor) as cursor:
+        await cursor.execute(
+            """
+            SELECT puid, server_alias, COUNT(*)
+            FROM user_servers
+            WHERE timestamp > %s AND timestamp <= %s
+            GROUP BY puid, server_alias
+            """,
+            (matrix.watermark, upper)
+        )
+        while True:
+            chunk = await cursor.fetchmany(FETCH_CHUNK_SIZE)
+            if not chunk:
+                break
+            for puid, server, count in chunk:
+                puids.append(puid)
+                servers.append(str(server))
+                counts.append(count)
+
+    if puids:
+        matrix.add(puids, servers, counts)
+    matrix.watermark = upper
+    logging.info(f"[tribe_inference.py] Read {len(puids)} new (player, server) join counts; "
+                 f"matrix is {len(matrix.puids)} x {len(matrix.servers)} with {len(matrix.counts)} cells.")
+
+def build_features(matrix):
+    """
+    TF-IDF style weights: log-scaled join counts, servers everyone visits count for less.
+    Returns (indptr, cols, values) of a row-normalized CSR matrix and the active row mask.
+    """
+    n_players, n_servers = len(matrix.puids), len(matrix.servers)
+    totals = np.bincount(matrix.rows, weights=matrix.counts, minlength=n_players)
+    active = totals >= MIN_JOINS
+
+    keep = active[matrix.rows]
+    rows, cols, counts = matrix.rows[keep], matrix.cols[keep], matrix.counts[keep]
+
+    players_per_server = np.bincount(cols, minlength=n_servers)
+    idf = np.log((1 + active.sum()) / (1 + players_per_server)) + 1.0
+    values = (np.log1p(counts) * idf[cols]).astype(np.float32)
+
+    norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=n_players))
+    values /= norms[rows]
+
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=n_players))])
+    return indptr, cols, values, active
+
+def score(indptr, cols, values, centroids, active_rows):
+    """
+    Cosine similarity of every active row to every centroid, computed in row chunks.
+    """
+    sims = np.zeros((len(active_rows), centroids.shape[0]), dtype=np.float32)
+    centroids_t = centroids.T
+    for start in range(0, len(active_rows), SCORE_CHUNK_ROWS):
+        chunk = active_rows[start:start + SCORE_CHUNK_ROWS]
+        lo, hi = indptr[chunk[0]], indptr[chunk[-1] + 1]
+        contributions = values[lo:hi, None] * centroids_t[cols[lo:hi]]
+        # Rows are contiguous in the triplets, so one reduceat sums each row's contributions
+        sims[start:start + len(chunk)] = np.add.reduceat(contributions, indptr[chunk] - lo, axis=0)
+    return sims
+
+def cluster(matrix, n_clusters, iterations=20, seed=0):
+    """
+    Spherical k-means over the sparse player x server matrix.
+    Returns (labels, similarity, centroids) for active players; labels are -1 for inactive ones.
+    """
+    indptr, cols, values, active = build_features(matrix)
+    active_rows = np.flatnonzero(active)
+    n_servers = len(matrix.servers)
+    labels = np.full(len(matrix.puids), -1, dtype=np.int64)
+    similarity = np.zeros(len(matrix.puids), dtype=np.float32)
+    if len(active_rows) == 0:
+        return labels, similarity, np.zeros((0, n_servers), dtype=np.float32)
+
+    n_clusters = min(n_clusters, len(active_rows))
+    rng = np.random.default_rng(seed)
+    row_of_cell = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+
+    # Seed with random active players
+    centroids = np.zeros((n_clusters, n_servers), dtype=np.float32)
+    for i, row in enumerate(rng.choice(active_rows, size=n_clusters, replace=False)):
+        centroids[i, cols[indptr[row]:indptr[row + 1]]] = values[indptr[row]:indptr[row + 1]]
+
+    assignment = np.zeros(len(active_rows), dtype=np.int64)
+    for iteration in range(iterations):
+        sims = score(indptr, cols, values, centroids, active_rows)
+        new_assignment = sims.argmax(axis=1)
+        changed = int((new_assignment != assignment).sum())
+        assignment = new_assignment
+
+        # New centroids are the normalized sums of their members' rows
+        labels[active_rows] = assignment
+        cell_labels = labels[row_of_cell]
+        centroids = np.bincount(
+            cell_labels * n_servers + cols, weights=values, minlength=n_clusters * n_servers
+        ).reshape(n_clusters, n_servers).astype(np.float32)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        centroids /= np.where(norms > 0, norms, 1)
+
+        logging.info(f"[tribe_inference.py] Iteration {iteration + 1}: {changed} players changed cluster.")
+        if iteration and changed == 0:
+            break
+
+    similarity[active_rows] = sims[np.arange(len(active_rows)), assignment]
+    return labels, similarity, centroids
+
+def group_labels(matrix, centroids):
+    """
+    Name each cluster after its two most characteristic servers, e.g. "G7:2154/2159".
+    """
+    names = []
+    for i, centroid in enumerate(centroids):
+        top = [matrix.servers[col] for col in np.argsort(centroid)[::-1][:2] if centroid[col] > 0]
+        names.append(f"G{i}:{'/'.join(top)}" if top else f"G{i}")
+    return names
+
+async def store_groups(conn, matrix, labels, similarity, names):
+    now = int(time.time())
+    rows = [
+        (matrix.puids[row], names[labels[row]], float(similarity[row]), now)
+        for row in np.flatnonzero(labels >= 0)
+    ]
+    async with conn.cursor() as cursor:
+        await cursor.execute(GROUPS_SCHEMA)
+        for i in range(0, len(rows), WRITE_CHUNK_SIZE):
+            await cursor.executemany(
+                """
+                INSERT INTO player_groups (puid, group_label, similarity, updated_at)
+                VALUES (%s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                    group_label = VALUES(group_label),
+                    similarity = VALUES(similarity),
+                    updated_at = VALUES(updated_at)
+                """,
+                rows[i:i + WRITE_CHUNK_SIZE]
+            )
+    await conn.commit()
+    logging.info(f"[tribe_inference.py] Stored group labels for {len(rows)} players.")
+
+async def run_tribe_inference(n_clusters=64, state_file=STATE_FILE):
+    start_time = time.time()
+    matrix = JoinMatrix.load(state_file)
+    conn = await db_connector()
+    try:
+        await read_new_joins(conn, matrix)
+        labels, similarity, centroids = cluster(matrix, n_clusters)
+        await store_groups(conn, matrix, labels, similarity, group_labels(matrix, centroids))
+    finally:
+        conn.close()
+    # Only advance the watermark once the labels are stored
+    matrix.save(state_file)
+    logging.info(f"[tribe_inference.py] Done in {time.time() - start_time:.2f} seconds.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cluster players by their server join history.")
+    parser.add_argument("--clusters", type=int, default=64, help="Number of groups to infer")
+    parser.add_argument("--state-file", default=STATE_FILE, help="Where the incremental join matrix is kept")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    asyncio.run(run_tribe_inference(args.clusters, args.state_file))
@@ -0,0 +1,151 @@
+# Per-endpoint concurrency limits, 429 backoff and circuit breaking for upstream APIs
+import asyncio
+import logging
+import time
+
+class UpstreamUnavailable(Exception):
+    '''Raised without calling the upstream while its circuit is open.'''
+
+class RateLimited(Exception):
+    '''Raised by a call that got HTTP 429, carries the Retry-After delay in seconds.'''
+
+    def __init__(self, retry_after=1.0):
+        super().__init__(f"Rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+class Upstream:
+    '''
+    Guards one upstream endpoint.
+
+    - At most `limit` calls run at once. The limit halves on every 429 and grows back
+      by one after `limit` successful calls in a row, up to max_concurrency.
+    - A 429 also pauses new calls for the Retry-After delay.
+    - After failure_threshold consecutive failures the circuit opens and calls fail fast
+      with UpstreamUnavailable for cooldown seconds. Then a single probe call is let
+      through: success closes the circuit, failure opens it again.
+    '''
+
+    def __init__(self, name, max_concurrency, failure_threshold=5, cooldown=30):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.failures = 0
+        self.successes = 0
+        self.opened_at = None
+        self.probing = False
+        self._cond = None  # Created on first use so it binds to the running loop
+
+    def available(self):
+        """
+        True when the circuit is closed or ready for a probe.
+        """
+        return self.opened_at is None or (time.monotonic() - self.opened_at >= self.cooldown and not self.probing)
+
+    async def call(self, func, *args, **kwargs):
+        probe = self._admit()
+        try:
+            await self._acquire()
+        except BaseException:
+            if probe:
+                self.probing = False
+            raise
+        try:
+            result = await func(*args, **kwargs)
+        except RateLimited as e:
+            self._on_rate_limited(e.retry_after)
+            self._on_failure(probe)
+            raise
+        except (Exception, asyncio.CancelledError):
+            # Cancellation here is almost always an asyncio.wait_for timeout
+            self._on_failure(probe)
+            raise
+        else:
+            self._on_success(probe)
+            return result
+        finally:
+            await self._release()
+
+    def _admit(self):
+        if self.opened_at is None:
+            return False
+        if time.monotonic() - self.opened_at < self.cooldown or self.probing:
+            raise UpstreamUnavailable(f"{self.name} is unavailable (circuit open)")
+        self.probing = True
+        logging.info(f"[upstream_guard.py] {self.name}: circuit half-open, sending probe.")
+        return True
+
+    async def _acquire(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                try:
+                    # Wake up on a release, or when the 429 pause is over
+                    await asyncio.wait_for(self._cond.wait(), timeout=wait if wait > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def _on_rate_limited(self, retry_after):
+        self.limit = max(1, self.limit // 2)
+        self.successes = 0
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        logging.warning(f"[upstream_guard.py] {self.name}: HTTP 429, limit lowered to {self.limit}, pausing {retry_after}s.")
+
+    def _on_success(self, probe):
+        if probe or self.opened_at is not None:
+            logging.info(f"[upstream_guard.py] {self.name}: call succeeded, circuit closed.")
+        self.opened_at = None
+        self.probing = False
+        self.failures = 0
+        self.successes += 1
+        if self.limit < self.max_concurrency and self.successes >= self.limit:
+            self.limit += 1
+            self.successes = 0
+
+    def _on_failure(self, probe):
+        self.successes = 0
+        self.failures += 1
+        if probe:
+            self.probing = False
+            self.opened_at = time.monotonic()
+            logging.warning(f"[upstream_guard.py] {self.name}: probe failed, circuit open again for {self.cooldown}s.")
+        elif self.opened_at is None and self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            logging.error(f"[upstream_guard.py] {self.name}: {self.failures} failures in a row, circuit open for {self.cooldown}s.")
+
+def check_status(response, name):
+    """
+    Raise RateLimited on HTTP 429 and a plain Exception on 5xx, so the guard can count them.
+    """
+    if response.status == 429:
+        try:
+            retry_after = float(response.headers.get("Retry-After", 1))
+        except ValueError:
+            retry_after = 1.0
+        raise RateLimited(retry_after)
+    if response.status >= 500:
+        raise Exception(f"{name} returned HTTP {response.status}")
+
+# One guard per upstream endpoint
+upstreams = {
+    "auth": Upstream("auth", max_concurrency=4),
+    "rtc": Upstream("rtc", max_concurrency=8),
+    "rtc_ws": Upstream("rtc_ws", max_concurrency=16),
+    "product_users": Upstream("product_users", max_concurrency=4),
+    "matchmaking": Upstream("matchmaking", max_concurrency=8),
+    "cdn": Upstream("cdn", max_concurrency=2),
+}